@@ -70,6 +70,11 @@ if 0:
     for row_index, one_boxed_row_flat_pixels in enumerate(pngdata):
         image_2d[row_index,:]=one_boxed_row_flat_pixels
 
+# PurePNG can also decode the whole image into an array of shape
+# ``(row_count, column_count, plane_count)`` allocated once:
+if 0:
+    image_3d = png.Reader(filename='picture.png').as_ndarray('direct')
+
 del pngReader
 del pngdata
 
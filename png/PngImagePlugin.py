@@ -77,12 +77,12 @@ class PngImageFile(ImageFile.ImageFile):
             sbit = struct.unpack('%dB' % len(self.png.sbit), self.png.sbit)
             bitdepth = max(sbit)
         if bitdepth < 8:
-            x, y, pixels, meta = self.png._as_rescale(direct, 8)
+            x, y, pixels, meta = self.png._convert(bitdepth=8)
         elif 16 > bitdepth > 8 and self.png.greyscale:
-            x, y, pixels, meta = self.png._as_rescale(direct, 16)
+            x, y, pixels, meta = self.png._convert(bitdepth=16)
         # PIL does not support RGB 16bit/channel
         elif bitdepth != 8 and (not self.png.greyscale or self.png.alpha):
-            x, y, pixels, meta = self.png._as_rescale(direct, 8)
+            x, y, pixels, meta = self.png._convert(bitdepth=8)
         else:
             x, y, pixels, meta = direct()
         self.size = x, y
@@ -14,6 +14,12 @@ except SyntaxError:
     from png import strtobytes
     from png import array
 
+try:
+    exec("from .asyncreader import AsyncReader", globals(), locals())
+except (SyntaxError, ImportError):
+    # Asynchronous reading requires Python 3.6
+    pass
+
 if __name__ == '__main__':
     import sys
     main(sys.argv)
@@ -0,0 +1,111 @@
+"""
+Reading PNG from asyncio streams.
+
+:class:`AsyncReader` reads PNG from ``asyncio.StreamReader`` or any other
+object with coroutine ``read(n)`` method.  Data is fed to
+:class:`png.Decoder` as it is received, so decoding interleaves with I/O
+without blocking event loop or using threads.
+
+This module requires Python 3.6 or newer.
+"""
+from .png import Decoder, Error, FormatError
+
+
+def _not_async(name):
+    """Method of :class:`png.Reader` which needs synchronous `read`"""
+    def method(self, *args, **kw):
+        raise Error("AsyncReader has no %s(), use coroutine read()" % name)
+    method.__name__ = name
+    return method
+
+
+class AsyncReader(Decoder):
+
+    """
+    PNG decoder for asynchronous streams.
+
+    Usage::
+
+        reader = AsyncReader(stream)
+        width, height, rows, meta = await reader.read()
+        async for row in rows:
+            ...
+
+    Coroutines :meth:`preamble` and :meth:`read` replace methods of
+    :class:`png.Reader`, other methods work with data already read.
+    Reading methods which would call synchronous :meth:`read` (like
+    :meth:`png.Reader.asRGBA8`) raise :class:`png.Error`.
+    """
+
+    def __init__(self, stream, **kw):
+        """
+        Create decoder reading from `stream`.
+
+        `stream` should have coroutine ``read(n)`` method, like
+        ``asyncio.StreamReader``.  Keyword options are as for
+        :class:`png.Decoder`.
+        """
+        self.stream = stream
+        Decoder.__init__(self, **kw)
+        # Rows decoded but not yielded yet
+        self._rows = []
+
+    # Methods of Reader which read synchronously would get coroutine
+    asDirect = _not_async('asDirect')
+    asFloat = _not_async('asFloat')
+    asRGB = _not_async('asRGB')
+    asRGBA = _not_async('asRGBA')
+    asRGB8 = _not_async('asRGB8')
+    asRGBA8 = _not_async('asRGBA8')
+    read_flat = _not_async('read_flat')
+    read_region = _not_async('read_region')
+    readinto = _not_async('readinto')
+    as_ndarray = _not_async('as_ndarray')
+    preview = _not_async('preview')
+    rows = _not_async('rows')
+    build_index = _not_async('build_index')
+
+    async def _receive(self):
+        """Receive and decode next piece of data, False at end of stream"""
+        data = await self.stream.read(2 ** 16)
+        if not data:
+            return False
+        self._rows.extend(self.feed(data))
+        return True
+
+    async def preamble(self, lenient=False):
+        """
+        Extract the image metadata
+
+        Coroutine version of :meth:`png.Reader.preamble`.
+        """
+        self.lenient = lenient
+        # Decoder is prepared for image data with first IDAT chunk
+        while self.filt is None:
+            if self.state == 'end' or not await self._receive():
+                raise FormatError('This PNG file has no IDAT chunks.')
+
+    async def read(self, lenient=False):
+        """
+        Read the PNG file and prepare decoding.
+
+        Coroutine version of :meth:`png.Reader.read`: returns
+        (`width`, `height`, `pixels`, `metadata`), but `pixels` is
+        asynchronous iterator over rows in boxed row flat pixel format.
+        Rows of straightlaced image are yielded as soon as their data
+        is received, interlaced image is yielded at the end of data.
+        """
+        await self.preamble(lenient=lenient)
+        return (self.width, self.height, self._iterrows(),
+                self._metadata())
+
+    async def _iterrows(self):
+        """Asynchronous iterator over decoded rows"""
+        while True:
+            rows, self._rows = self._rows, []
+            for row in rows:
+                yield row
+            if self.state == 'end' or not await self._receive():
+                break
+        for row in self.close():
+            yield row
@@ -139,11 +139,14 @@ And now, my famous members
 """
 
 from array import array
+from collections import namedtuple
 import itertools
 import logging
 import math
+import numbers
 # http://www.python.org/doc/2.4.4/lib/module-operator.html
 import operator
+import os
 import datetime
 import time
 import struct
@@ -153,22 +156,55 @@ import zlib
 import warnings
 
 try:
-    from functools import reduce
+    from itertools import imap as map
 except ImportError:
-    # suppose to get there on python<2.7 where reduce is only built-in function
+    # On Python 3 there is no imap, but map works like imap instead
     pass
 
 try:
-    from itertools import imap as map
+    import mmap
 except ImportError:
-    # On Python 3 there is no imap, but map works like imap instead
-    pass
+    # Memory mapped input is just an option
+    mmap = None
+
+try:
+    memoryview
+except NameError:
+    # Python 2.6 has no memoryview, data is copied there instead
+    memoryview = None
+
+# Python 3 views have integer items and can be cast and sliced with step,
+# Python 2 views (items are strings) are used only for plain copying
+_memoryview_cast = hasattr(memoryview, 'cast')
+
+# NumPy is optional acceleration which is imported only when needed
+# (see `_import_numpy`), so it does not slow down plain import
+numpy = None
+_numpy_missing = False
+
+try:
+    from multiprocessing.pool import ThreadPool
+except ImportError:
+    # No threads on this platform (or Python < 2.6): compress serially
+    ThreadPool = None
+
+try:
+    import threading
+except ImportError:
+    # Pipelined reading is just an option
+    threading = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 __version__ = "0.3.0"
-__all__ = ['png_signature', 'Image', 'Reader', 'Writer',
+__all__ = ['png_signature', 'Image', 'Reader', 'Writer', 'Decoder',
            'Error', 'FormatError', 'ChunkError',
            'Filter', 'register_extra_filter',
            'write_chunks', 'from_array', 'parse_mode', 'MergedPlanes',
+           'probe', 'probe_many', 'ProbeInfo',
            'PERCEPTUAL', 'RELATIVE_COLORIMETRIC', 'SATURATION',
            'ABSOLUTE_COLORIMETRIC']
 
@@ -297,6 +333,11 @@ try:
 except NameError:
     basestring = str
 
+try:
+    unicode
+except NameError:
+    unicode = str
+
 # Conditionally convert to bytes.  Works on Python 2 and Python 3.
 try:
     bytes('', 'ascii')
@@ -318,6 +359,71 @@ except NameError:
     from sets import Set as set
 
 
+def ndarray_packed_rows(a, bitdepth):
+    """
+    Iterator over rows of NumPy array `a` in boxed row packed format.
+
+    `a` is 2- or 3-dimensional array (first axis is height) of unsigned
+    integers or booleans.  Rows are converted with NumPy operations
+    only: 8-bit rows are used as is (via buffer interface), 16-bit are
+    converted to big-endian in bulk, 1-bit are packed with
+    ``numpy.packbits``.  Values which do not fit `bitdepth` raise
+    ValueError.
+    """
+    _import_numpy()
+    _check_ndarray_range(a, bitdepth)
+    # Python 2.6 has no memoryview, rows are copied there
+    asbytes = memoryview or bytearray
+    for row in a:
+        row = row.reshape(-1)
+        if bitdepth == 16:
+            yield asbytes(row.astype('>u2').view(numpy.uint8))
+        elif bitdepth == 8:
+            yield asbytes(numpy.ascontiguousarray(row, dtype=numpy.uint8))
+        elif bitdepth == 1:
+            yield asbytes(numpy.packbits(row))
+        else:
+            yield pack_samples(
+                numpy.ascontiguousarray(row, dtype=numpy.uint8), bitdepth)
+
+
+def _check_ndarray_range(a, bitdepth):
+    """Raise ValueError if NumPy array `a` has values beyond `bitdepth`"""
+    # Conversion with `astype` would silently truncate them
+    maxval = 2 ** bitdepth - 1
+    kind = a.dtype.kind
+    if kind == 'b' or not a.size:
+        return
+    if kind in 'ui':
+        info = numpy.iinfo(a.dtype)
+        if info.min >= 0 and info.max <= maxval:
+            # Type can't hold values out of range, no need to scan
+            return
+    if a.max() > maxval or (kind != 'u' and a.min() < 0):
+        raise ValueError("array values are out of range for bitdepth %d" %
+                         bitdepth)
+
+
+def _import_numpy():
+    """Import NumPy on first use, return None when it is not available"""
+    global numpy, _numpy_missing
+    if numpy is None and not _numpy_missing:
+        try:
+            import numpy
+        except ImportError:
+            _numpy_missing = True
+    return numpy
+
+
+def _is_ndarray(a):
+    """Whether `a` is NumPy array, checked without importing NumPy"""
+    module = sys.modules.get('numpy')
+    if module is None or not isinstance(a, module.ndarray):
+        return False
+    _import_numpy()
+    return True
+
+
 def peekiter(iterable):
     """Return first row and also iterable with same items as original"""
     it = iter(iterable)
@@ -326,11 +432,374 @@ def peekiter(iterable):
     def gen():
         """Generator that returns first and proxy other items from source"""
         yield one
-        while True:
-            yield next(it)
+        for item in it:
+            yield item
     return (one, gen())
 
 
+# Translation tables for unpacking samples (see `unpack_samples`)
+_unpack_tables = {}
+
+
+def unpack_samples(raw, bitdepth, width=None):
+    """
+    Convert bytes of packed samples to flat row of sample values.
+
+    For `bitdepth` 8 `raw` is returned as is, for 16 result is ``array``
+    of native integers, for 1, 2 and 4 it is ``bytearray``.
+    `width` is number of samples in one row; when `raw` is shorter
+    than that row is truncated, otherwise padding bits at the end
+    of each row are skipped.
+
+    Unpacking uses only C-level operations: 16-bit values are swapped
+    with ``array.byteswap``, every sample position of smaller bitdepth
+    is extracted from all bytes at once with ``translate`` lookup table.
+    """
+    if bitdepth == 8:
+        return raw
+    if bitdepth == 16:
+        out = array('H')
+        if hasattr(out, 'frombytes'):
+            out.frombytes(raw)
+        else:
+            out.fromstring(bytearray_to_bytes(bytearray(raw)))
+        if sys.byteorder == 'little':
+            out.byteswap()
+        return out
+    assert bitdepth < 8
+    tables = _unpack_tables.get(bitdepth)
+    # Samples per byte
+    spb = 8 // bitdepth
+    if tables is None:
+        mask = 2 ** bitdepth - 1
+        tables = []
+        #                 reversed range(spb)
+        for shift in range(bitdepth * (spb - 1), -1, -bitdepth):
+            tables.append(bytearray_to_bytes(
+                bytearray([mask & (it >> shift) for it in range(256)])))
+        _unpack_tables[bitdepth] = tables
+    if not isinstance(raw, (bytes, bytearray)):
+        raw = bytearray(raw)
+    out = newBarray(len(raw) * spb)
+    for i in range(spb):
+        out[i::spb] = raw.translate(tables[i])
+    if width is None or width % spb == 0:
+        return out
+    # Drop padding of each row
+    row_len = (width // spb + 1) * spb
+    if len(out) <= row_len:
+        return out[:width]
+    res = newBarray()
+    for offset in range(0, len(out), row_len):
+        res.extend(out[offset:offset + width])
+    return res
+
+
+def palette_expander(plte, bitdepth, width):
+    """
+    Return function which converts row of palette indices to colours.
+
+    `plte` is palette as returned by :meth:`Reader.palette`, `bitdepth`
+    is bitdepth of indices which are packed (1, 2, 4 or 8) and `width`
+    is number of pixels in a row.  Function returns ``bytearray`` of
+    RGB or RGBA values.
+
+    Each channel of every index position in byte is a ``translate``
+    lookup table, so expansion needs no Python operation per pixel.
+    """
+    planes = len(plte[0])
+    # Samples per byte
+    spb = 8 // bitdepth
+    mask = 2 ** bitdepth - 1
+    # Colours for every possible index, missing entries are black
+    colours = list(plte) + [(0,) * planes] * (mask + 1 - len(plte))
+    tables = []
+    #                 reversed range(spb)
+    for shift in range(bitdepth * (spb - 1), -1, -bitdepth):
+        for plane in range(planes):
+            tables.append(bytearray_to_bytes(bytearray(
+                [colours[mask & (it >> shift)][plane] for it in range(256)])))
+    # Bytes with indices which are all in palette
+    valid_byte = [max([mask & (it >> shift)
+                       for shift in range(0, 8, bitdepth)]) < len(plte)
+                  for it in range(256)]
+    valid = bytearray_to_bytes(bytearray([it for it in range(256)
+                                          if valid_byte[it]]))
+    step = spb * planes
+    # Bytes with only pixels and mask of pixels in the last byte,
+    # padding bits after them may have any value
+    full = width // spb
+    pad_mask = (0xff00 >> ((width % spb) * bitdepth)) & 0xff
+
+    def expand(row):
+        """Colours of indices in `row`"""
+        if not isinstance(row, (bytes, bytearray)):
+            row = bytearray(row)
+        if len(valid) < 256 and row.translate(None, valid):
+            if (row[:full].translate(None, valid) or
+                    not valid_byte[bytearray(row[full:full + 1])[0] &
+                                   pad_mask]):
+                raise FormatError('Palette index is not in PLTE chunk.')
+        out = newBarray(len(row) * step)
+        for i in range(step):
+            out[i::step] = row.translate(tables[i])
+        if len(out) > width * planes:
+            # Padding at the end of row
+            del out[width * planes:]
+        return out
+    return expand
+
+
+# Translation tables for packing samples (see `pack_samples`)
+_pack_tables = {}
+
+
+def pack_samples(row, bitdepth):
+    """
+    Convert flat row of sample values to bytes of packed samples.
+
+    Reverse of :meth:`unpack_samples`, for `bitdepth` 16 each value is
+    decomposed into 2 bytes, for 1, 2 and 4 several samples are packed
+    into each byte (last byte is padded with zero bits).
+
+    Like unpacking it avoids per-sample python code: 16-bit values are
+    swapped with ``array.byteswap``; for smaller bitdepth every sample
+    position is shifted to its place with ``translate`` lookup table
+    and all positions are merged with bitwise or of long integers.
+    """
+    if bitdepth == 8:
+        return bytearray(row)
+    if bitdepth == 16:
+        out = array('H', row)
+        if sys.byteorder == 'little':
+            out.byteswap()
+        if hasattr(out, 'tobytes'):
+            return bytearray(out.tobytes())
+        return bytearray(out.tostring())
+    assert bitdepth < 8
+    # Samples per byte
+    spb = 8 // bitdepth
+    tables = _pack_tables.get(bitdepth)
+    if tables is None:
+        mask = 2 ** bitdepth - 1
+        tables = []
+        #                 reversed range(spb)
+        for shift in range(bitdepth * (spb - 1), -1, -bitdepth):
+            tables.append(bytearray_to_bytes(
+                bytearray([(mask & it) << shift for it in range(256)])))
+        _pack_tables[bitdepth] = tables
+    row = bytearray(row)
+    # Adding padding so we can pack into a whole number of bytes
+    row.extend(newBarray(-len(row) % spb))
+    return _merge_bytes(operator.or_, [row[i::spb].translate(tables[i])
+                                       for i in range(spb)])
+
+
+def _merge_bytes(op, parts):
+    """
+    Combine byte strings of equal length with bitwise `op`.
+
+    Strings are converted to long integers, so `op` (``operator.or_``,
+    ``operator.and_``) is applied to all bytes at once.
+    """
+    length = len(parts[0])
+    if hasattr(int, 'from_bytes'):
+        res = int.from_bytes(parts[0], 'big')
+        for part in parts[1:]:
+            res = op(res, int.from_bytes(part, 'big'))
+        return bytearray(res.to_bytes(length, 'big'))
+    # No bytes to long conversion (Python 2)
+    res = bytearray(parts[0])
+    for part in parts[1:]:
+        res = bytearray(map(op, res, bytearray(part)))
+    return res
+
+
+def _sample_bytes(row):
+    """Bytes of row of samples (in native byte order)"""
+    if isinstance(row, (bytes, bytearray)):
+        return row
+    if isinstance(row, array):
+        if hasattr(row, 'tobytes'):
+            return bytearray(row.tobytes())
+        return bytearray(row.tostring())
+    return bytearray(row)
+
+
+# Tables which mark bytes equal to index with 1 and other with 0
+_equal_tables = [bytearray_to_bytes(bytearray([0] * it + [1] +
+                                              [0] * (255 - it)))
+                 for it in range(256)]
+
+
+def trns_alpha(row, planes, bitdepth, transparent):
+    """
+    Add alpha channel to flat row using transparent colour.
+
+    `transparent` is tuple of `planes` values (as ``transparent``
+    attribute of :class:`Reader`); pixels of this colour get alpha 0,
+    all others - maximum value.  Result is ``bytearray`` for bitdepth up
+    to 8 and ``array`` of native integers for 16.
+
+    Pixels are compared by bytes: every byte of pixel is matched with
+    ``translate`` table and results are combined with bitwise and.
+    """
+    maxval = 2 ** bitdepth - 1
+    arraycode = 'BH'[bitdepth > 8]
+    data = _sample_bytes(row)
+    itemsize = (1, 2)[bitdepth > 8]
+    pixel_size = planes * itemsize
+    # 1 for transparent pixels, 0 for opaque
+    if max(transparent) > 2 ** (8 * itemsize) - 1:
+        # Such colour could not be in image
+        match = newBarray(len(data) // pixel_size)
+    else:
+        target = _sample_bytes(array(arraycode, transparent))
+        match = _merge_bytes(operator.and_, [
+            data[i::pixel_size].translate(_equal_tables[target[i]])
+            for i in range(pixel_size)])
+    alpha = match.translate(
+        bytearray_to_bytes(bytearray([maxval & 0xff, 0] + [0] * 254)))
+    if bitdepth > 8:
+        # 0xffff and 0 are same in any byte order
+        wide = newBarray(len(alpha) * 2)
+        wide[0::2] = alpha
+        wide[1::2] = alpha
+        alpha = array('H')
+        if hasattr(alpha, 'frombytes'):
+            alpha.frombytes(bytearray_to_bytes(wide))
+        else:
+            alpha.fromstring(bytearray_to_bytes(wide))
+        out = newHarray(len(row) + len(alpha))
+    else:
+        out = newBarray(len(row) + len(alpha))
+    for i in range(planes):
+        out[i::planes + 1] = row[i::planes]
+    out[planes::planes + 1] = alpha
+    return out
+
+
+# Translation tables for shifting samples (see `shift_samples`)
+_shift_tables = {}
+
+
+def shift_samples(row, bitdepth, shift):
+    """
+    Shift all samples in flat row right by `shift` bits.
+
+    Result is ``bytearray`` when it fits in bytes and ``array`` of
+    native integers otherwise.  Shifting is done with ``translate``
+    lookup tables applied to high and low bytes of samples.
+    """
+    tables = _shift_tables.get((bitdepth, shift))
+    if tables is None:
+        table = bytearray_to_bytes(bytearray([it >> (shift % 8)
+                                              for it in range(256)]))
+        # Bits moving from high byte to low byte
+        carry = None
+        if bitdepth > 8 and shift < 8:
+            carry = bytearray_to_bytes(bytearray(
+                [(it << (8 - shift)) & 0xff for it in range(256)]))
+        tables = _shift_tables[(bitdepth, shift)] = (table, carry)
+    table, carry = tables
+    if bitdepth <= 8:
+        return bytearray(row).translate(table)
+    data = _sample_bytes(row)
+    if sys.byteorder == 'little':
+        low, high = data[0::2], data[1::2]
+    else:
+        high, low = data[0::2], data[1::2]
+    if shift >= 8:
+        return high.translate(table)
+    low = _merge_bytes(operator.or_, [low.translate(table),
+                                      high.translate(carry)])
+    high = high.translate(table)
+    data = newBarray(len(data))
+    if sys.byteorder == 'little':
+        data[0::2], data[1::2] = low, high
+    else:
+        data[0::2], data[1::2] = high, low
+    out = array('H')
+    if hasattr(out, 'frombytes'):
+        out.frombytes(bytearray_to_bytes(data))
+    else:
+        out.fromstring(bytearray_to_bytes(data))
+    return out
+
+
+# Lookup tables for rescaling (see `rescale_lut`)
+_rescale_luts = {}
+_rescale_tables = {}
+
+
+def rescale_lut(source, target, shift=0):
+    """
+    Lookup table which rescales samples from `source` to `target` bitdepth.
+
+    Sample values are first shifted right by `shift` bits (like for
+    ``sBIT`` chunk), so range of ``source - shift`` bits is scaled to
+    range of `target` bits.  Tables are computed once for each pair of
+    bitdepths and shared by :class:`Reader` and :class:`Writer`.
+    """
+    key = (source, target, shift)
+    lut = _rescale_luts.get(key)
+    if lut is None:
+        factor = float(2 ** target - 1) / float(2 ** (source - shift) - 1)
+        lut = [int(round((it >> shift) * factor))
+               for it in range(2 ** source)]
+        _rescale_luts[key] = lut
+    return lut
+
+
+def rescale_samples(row, source, target, shift=0):
+    """
+    Rescale flat row of samples from `source` to `target` bitdepth.
+
+    See :meth:`rescale_lut` for `shift`.  Result is ``bytearray`` for
+    `target` up to 8 and ``array`` of native integers otherwise.
+    Rows of bytes are converted with ``translate``, others by indexing
+    lookup table with ``map``, so there is no Python code per sample.
+    Samples are not checked, they should be integers which fit `source`
+    (see :meth:`_check_samples`).
+    """
+    lut = rescale_lut(source, target, shift)
+    if target <= 8:
+        if source <= 8 and isinstance(row, (bytes, bytearray)):
+            table = _rescale_tables.get((source, target, shift))
+            if table is None:
+                table = bytearray_to_bytes(
+                    bytearray(lut + [0] * (256 - len(lut))))
+                _rescale_tables[(source, target, shift)] = table
+            return row.translate(table)
+        return bytearray(map(lut.__getitem__, row))
+    return array('H', map(lut.__getitem__, row))
+
+
+def _check_samples(row, bitdepth):
+    """
+    Check that samples of input `row` fit `bitdepth` before rescaling.
+
+    Raises ValueError for samples out of range, as table lookup would
+    wrap or fail on them.  Fractional samples are rounded, so returned
+    row may be a new list.
+    """
+    if not len(row):
+        return row
+    top = max(row)
+    if isinstance(row, bytes) and not isinstance(top, int):
+        # Python 2 string
+        top = ord(top)
+    elif not isinstance(top, numbers.Integral):
+        # Fractional samples can't index table, round them first
+        row = [int(round(x)) for x in row]
+        top = max(row)
+    if top >= 2 ** bitdepth or (not isinstance(row, (bytes, bytearray)) and
+                                min(row) < 0):
+        raise ValueError("sample values are out of range for "
+                         "bitdepth %d" % bitdepth)
+    return row
+
+
 def check_palette(palette):
     """
     Check a palette argument (to the :class:`Writer` class) for validity.
@@ -638,6 +1107,18 @@ class BaseFilter(object):
         The scanline will have the effects of filtering removed.
         Scanline modified inplace and also returned as result.
         """
+        self._undo_filter(filter_type, line)
+        # This will not work writing cython attributes from python
+        # Only 'cython from cython' or 'python from python'
+        self.prev[:] = line
+        return line
+
+    def _undo_filter(self, filter_type, line):
+        """
+        Undo the filter for a scanline without keeping it as previous.
+
+        Caller should copy `line` to `prev` or make it new `prev`.
+        """
         assert 0 <= filter_type <= 4
         # For the first line of a pass, synthesize a dummy previous line.
         if self.prev is None:
@@ -659,11 +1140,6 @@ class BaseFilter(object):
         elif filter_type == 4:
             self.__undo_filter_paeth(line)
 
-        # This will not work writing cython attributes from python
-        # Only 'cython from cython' or 'python from python'
-        self.prev[:] = line[:]
-        return line
-
     def _filter_scanline(self, filter_type, line, result):
         """
         Apply a scanline filter to a scanline.
@@ -695,11 +1171,72 @@ class BaseFilter(object):
         elif filter_type == 4:
             self.__do_filter_paeth(line, result)
 
+    def _best_filter(self, line):
+        """
+        Choose filter type with minimal sum of absolute differences.
+
+        All five filters are evaluated in one pass over `line` without
+        making filtered rows.  Filtered bytes are treated as signed,
+        so 255 costs as much as 1 (heuristic of libpng).
+        """
+        previous = self.prev
+        if previous is None:
+            previous = newBarray(len(line))
+        s0 = 0
+        s1 = 0
+        s2 = 0
+        s3 = 0
+        s4 = 0
+        ai = -self.fu
+        for i in range(len(line)):
+            x = line[i]
+            b = previous[i]
+            if ai < 0:
+                a = 0
+                c = 0
+            else:
+                a = line[ai]
+                c = previous[ai]
+            s0 += x if x < 128 else 256 - x
+            r = (x - a) & 0xff
+            s1 += r if r < 128 else 256 - r
+            r = (x - b) & 0xff
+            s2 += r if r < 128 else 256 - r
+            r = (x - ((a + b) >> 1)) & 0xff
+            s3 += r if r < 128 else 256 - r
+            pa = abs(b - c)
+            pb = abs(a - c)
+            pc = abs(a + b - c - c)
+            if pa <= pb and pa <= pc:
+                pr = a
+            elif pb <= pc:
+                pr = b
+            else:
+                pr = c
+            r = (x - pr) & 0xff
+            s4 += r if r < 128 else 256 - r
+            ai += 1
+        # First one wins on equal sums
+        best = 0
+        score = s0
+        if s1 < score:
+            best = 1
+            score = s1
+        if s2 < score:
+            best = 2
+            score = s2
+        if s3 < score:
+            best = 3
+            score = s3
+        if s4 < score:
+            best = 4
+        return best
+
     # Todo: color conversion functions should be moved
     # to a separate part in future
     def convert_la_to_rgba(self, row, result):
         """Convert a grayscale image with alpha to RGBA."""
-        for i in range(len(row) // 3):
+        for i in range(len(row) // 2):
             for j in range(3):
                 result[(4 * i) + j] = row[2 * i]
             result[(4 * i) + 3] = row[(2 * i) + 1]
@@ -711,7 +1248,7 @@ class BaseFilter(object):
         This method assumes the alpha channel in result is already
         correctly initialized.
         """
-        for i in range(len(row) // 3):
+        for i in range(len(row)):
             for j in range(3):
                 result[(4 * i) + j] = row[i]
 
@@ -728,6 +1265,115 @@ class BaseFilter(object):
 
 
 iBaseFilter = BaseFilter  # 'i' means 'internal'
+
+
+class npBaseFilter(iBaseFilter):
+
+    """
+    Filtering with whole row operations of NumPy
+
+    Used instead of :class:`BaseFilter` when compiled part is not available.
+    NumPy is imported when the first filter is created, without it pure
+    python methods are used.  Filters which depend on reconstructed
+    previous pixel (undo of average and paeth) can't be vectorised and
+    use pure python anyway.
+    """
+
+    def __init__(self, bitdepth=8):
+        iBaseFilter.__init__(self, bitdepth)
+        self.use_numpy = _import_numpy() is not None
+
+    def _undo_filter(self, filter_type, line):
+        """
+        Undo the filter for a scanline without keeping it as previous.
+
+        See :meth:`BaseFilter._undo_filter`
+        """
+        if not self.use_numpy:
+            iBaseFilter._undo_filter(self, filter_type, line)
+            return
+        if self.prev is None:
+            self.prev = newBarray(len(line))
+            if filter_type == 2:  # "up"
+                filter_type = 0
+            elif filter_type == 4:  # "paeth"
+                filter_type = 1
+        if filter_type > 2:
+            iBaseFilter._undo_filter(self, filter_type, line)
+            return
+
+        scanline = numpy.frombuffer(line, numpy.uint8)
+        if filter_type == 1:
+            # Running sum for each byte of pixel (uint8 wraps by itself)
+            for i in range(self.fu):
+                numpy.cumsum(scanline[i::self.fu], dtype=numpy.uint8,
+                             out=scanline[i::self.fu])
+        elif filter_type == 2:
+            scanline += numpy.frombuffer(self.prev, numpy.uint8)
+
+    def _filter_scanline(self, filter_type, line, result):
+        """
+        Apply a scanline filter to a scanline.
+
+        See :meth:`BaseFilter._filter_scanline`
+        """
+        if not self.use_numpy:
+            iBaseFilter._filter_scanline(self, filter_type, line, result)
+            return
+        assert 0 <= filter_type < 5
+        if self.prev is None:
+            if filter_type == 2:  # "up"
+                filter_type = 0
+            elif filter_type == 3:
+                self.prev = newBarray(len(line))
+            elif filter_type == 4:  # "paeth"
+                filter_type = 1
+        if filter_type == 0:
+            return
+        fu = self.fu
+        x = numpy.frombuffer(line, numpy.uint8)
+        res = numpy.frombuffer(result, numpy.uint8)
+        if filter_type == 1:
+            res[fu:] = x[fu:] - x[:-fu]
+            return
+        b = numpy.frombuffer(self.prev, numpy.uint8)
+        if filter_type == 2:
+            res[:] = x - b
+            return
+        a = numpy.zeros(len(x), numpy.int16)
+        a[fu:] = x[:-fu]
+        if filter_type == 3:
+            res[:] = x - ((a + b) >> 1).astype(numpy.uint8)
+        else:
+            b = b.astype(numpy.int16)
+            c = numpy.zeros(len(x), numpy.int16)
+            c[fu:] = b[:-fu]
+            pa = numpy.abs(b - c)
+            pb = numpy.abs(a - c)
+            pc = numpy.abs(a + b - c - c)
+            pr = numpy.where((pa <= pb) & (pa <= pc), a,
+                             numpy.where(pb <= pc, b, c))
+            res[:] = x - pr.astype(numpy.uint8)
+
+    def _best_filter(self, line):
+        """
+        Choose filter type with minimal sum of absolute differences.
+
+        See :meth:`BaseFilter._best_filter`
+        """
+        if not self.use_numpy:
+            return iBaseFilter._best_filter(self, line)
+        x = numpy.frombuffer(line, numpy.uint8)
+        res = numpy.empty(len(x), numpy.uint8)
+        sums = []
+        for filter_type in range(5):
+            res[:] = x
+            self._filter_scanline(filter_type, line, res)
+            sums.append(numpy.abs(res.view(numpy.int8), dtype=numpy.int16)
+                        .sum())
+        return sums.index(min(sums))
+
+
 try:
     BaseFilter = _rel_import('pngfilters', 'BaseFilter')
 except:
@@ -736,7 +1382,8 @@ except:
         logging.error("Error during import of compiled filters!")
         logging.error(sys.exc_info()[1])
         logging.error("Fallback to pure python mode!")
-    BaseFilter = iBaseFilter
+    # NumPy or pure python is chosen by each filter (see `npBaseFilter`)
+    BaseFilter = npBaseFilter
 
 
 class Writer(object):
@@ -755,6 +1402,7 @@ class Writer(object):
                  interlace=False,
                  chunk_limit=2 ** 20,
                  icc_profile=None,
+                 threads=None,
                  **kwargs
                  ):
         """
@@ -788,6 +1436,8 @@ class Writer(object):
         icc_profile
             tuple of (`name`, `databytes`) or just data bytes
             to write ICC Profile
+        threads
+            Number of threads used to compress ``IDAT`` data.
 
         Extra keywords:
             text
@@ -887,6 +1537,12 @@ class Writer(object):
         `chunk_limit` is used to limit the amount of memory used whilst
         compressing the image.  In order to avoid using large amounts of
         memory, multiple ``IDAT`` chunks may be created.
+
+        If `threads` is greater than 1 the filtered image data is split
+        into blocks of about `chunk_limit` bytes which are compressed
+        in parallel by a pool of threads (``zlib`` releases the GIL).
+        Each block is primed with the last 32 KiB of the previous one,
+        so compression ratio is nearly the same as for a single stream.
         """
         width, height = check_sizes(kwargs.pop('size', None),
                                     width, height)
@@ -981,6 +1637,7 @@ class Writer(object):
         self.compression = compression
         self.chunk_limit = chunk_limit
         self.interlace = bool(interlace)
+        self.threads = threads
 
         if bool(self.palette) and (self.greyscale or self.alpha):
             raise FormatError("Paletted image could not be grayscale or"
@@ -1244,6 +1901,8 @@ class Writer(object):
           Interlacing will require the entire image to be in working
           memory.
         """
+        if _is_ndarray(rows):
+            return self._write_ndarray(outfile, rows)
         if self.interlace:
             fmt = 'BH'[self.bitdepth > 8]
             a = array(fmt, itertools.chain(*rows))
@@ -1310,13 +1969,13 @@ class Writer(object):
                     raise Error("writing packed pixels not suitable for"
                                 " bit depth %d" % self.bitdepth)
                 self.bitdepth = targetbitdepth
-                factor = \
-                    float(2**targetbitdepth - 1) / float(2**srcbitdepth - 1)
 
                 def scalerow(inrows):
                     """Rescale all pixels"""
                     for row in inrows:
-                        yield [int(round(factor * x)) for x in row]
+                        row = _check_samples(row, srcbitdepth)
+                        yield rescale_samples(row, srcbitdepth,
+                                              targetbitdepth)
 
                 rows = scalerow(rows)
 
@@ -1398,6 +2057,10 @@ class Writer(object):
     def comp_idat(self, idat):
         """Generator that produce compressed IDAT chunks from IDAT data"""
         # http://www.w3.org/TR/PNG/#11IDAT
+        if self.threads and self.threads > 1 and ThreadPool is not None:
+            for compressed in self.comp_idat_parallel(idat):
+                yield compressed
+            return
         if self.compression is not None:
             compressor = zlib.compressobj(self.compression)
         else:
@@ -1410,11 +2073,63 @@ class Writer(object):
         if len(flushed):
             yield flushed
 
+    def comp_idat_parallel(self, idat):
+        """
+        Generator that produce compressed IDAT chunks using thread pool
+
+        Every block of `idat` is deflated separately as raw deflate data
+        ended with sync flush, using previous 32 KiB as dictionary.
+        Blocks are joined into single zlib stream with combined Adler-32.
+        """
+        level = self.compression
+        if level is None:
+            level = -1
+        # zlib header for this level (CMF, FLG with FLEVEL and FCHECK)
+        if level in (-1, 6):
+            header = strtobytes('\x78\x9c')
+        elif level < 2:
+            header = strtobytes('\x78\x01')
+        elif level < 6:
+            header = strtobytes('\x78\x5e')
+        else:
+            header = strtobytes('\x78\xda')
+        checksum = 1  # Adler-32 of empty data
+        window = bytes()
+        pending = []
+        pool = ThreadPool(self.threads)
+        try:
+            for dat in idat:
+                pending.append(pool.apply_async(_deflate_block,
+                                                (level, dat, window)))
+                if len(dat) >= _deflate_window:
+                    window = bytes(dat[-_deflate_window:])
+                else:
+                    window = (window + bytes(dat))[-_deflate_window:]
+                # Limit amount of blocks waiting in memory
+                while len(pending) > 2 * self.threads or\
+                        (pending and pending[0].ready()):
+                    compressed, adler, length = pending.pop(0).get()
+                    checksum = _adler32_combine(checksum, adler, length)
+                    if len(compressed):
+                        yield header + compressed
+                        header = bytes()
+            while pending:
+                compressed, adler, length = pending.pop(0).get()
+                checksum = _adler32_combine(checksum, adler, length)
+                if len(compressed):
+                    yield header + compressed
+                    header = bytes()
+        finally:
+            pool.terminate()
+        # Empty final block and checksum close the stream
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        yield header + compressor.flush() + struct.pack('!I', checksum)
+
     def idat(self, rows, packed=False):
         """Generator that produce uncompressed IDAT data from rows"""
         # http://www.w3.org/TR/PNG/#11IDAT
         filt = Filter(self.bitdepth * self.planes,
-                      self.interlace, self.height)
+                      self.interlace, self.height, reuse=True)
         data = bytearray()
 
         def byteextend(rowbytes):
@@ -1426,30 +2141,12 @@ class Writer(object):
         # stuffs them onto the data array.
         if self.bitdepth == 8 or packed:
             extend = byteextend
-        elif self.bitdepth == 16:
-            def extend(sl):
-                """Decompose into bytes before byteextend"""
-                fmt = '!%dH' % len(sl)
-                byteextend(bytearray(struct.pack(fmt, *sl)))
         else:
-            # Pack into bytes
-            assert self.bitdepth < 8
-            # samples per byte
-            spb = 8 // self.bitdepth
+            bitdepth = self.bitdepth
 
             def extend(sl):
                 """Pack into bytes before byteextend"""
-                a = bytearray(sl)
-                # Adding padding bytes so we can group into a whole
-                # number of spb-tuples.
-                l = float(len(a))
-                extra = math.ceil(l / float(spb)) * spb - l
-                a.extend([0] * int(extra))
-                # Pack into bytes
-                l = group(a, spb)
-                l = [reduce(lambda x, y: (x << self.bitdepth) + y, e)
-                     for e in l]
-                byteextend(l)
+                byteextend(pack_samples(sl, bitdepth))
 
         # Build the first row, testing mostly to see if we need to
         # changed the extend function to cope with NumPy integer types
@@ -1495,12 +2192,44 @@ class Writer(object):
         Write an array in flat row flat pixel format as a PNG file on
         the output file.  See also :meth:`write` method.
         """
-
+        if _is_ndarray(pixels):
+            return self._write_ndarray(outfile, pixels.reshape(self.height,
+                                                               -1))
         if self.interlace:
             self.write_passes(outfile, self.array_scanlines_interlace(pixels))
         else:
             self.write_passes(outfile, self.array_scanlines(pixels))
 
+    def _write_ndarray(self, outfile, a):
+        """
+        Write NumPy array `a` (2- or 3-dimensional, first axis is height)
+
+        When bitdepth is supported by PNG rows are packed with NumPy
+        operations (see :meth:`ndarray_packed_rows`), other cases are
+        converted to flat ``array`` in bulk.
+        """
+        if len(a) != self.height:
+            raise ValueError("rows supplied (%d) does not match height (%d)"
+                             % (len(a), self.height))
+        native = (self.bitdepth in (8, 16) or (self.bitdepth in (1, 2, 4) and
+                  (self.palette or (self.greyscale is True and
+                                    not self.alpha))))
+        if native and not self.interlace and self.greyscale != 'try':
+            return self.write_passes(outfile,
+                                     ndarray_packed_rows(a, self.bitdepth),
+                                     packed=True)
+        _check_ndarray_range(a, self.bitdepth)
+        fmt = 'BH'[self.bitdepth > 8]
+        pixels = array(fmt)
+        data = numpy.ascontiguousarray(a, dtype=('=u1', '=u2')[fmt == 'H'])
+        if hasattr(pixels, 'frombytes'):
+            pixels.frombytes(data.tobytes())
+        else:
+            pixels.fromstring(data.tostring())
+        if self.interlace:
+            return self.write_array(outfile, pixels)
+        return self.write_passes(outfile, self.array_scanlines(pixels))
+
     def write_packed(self, outfile, rows):
         """
         Write PNG file to `outfile`.
@@ -1565,6 +2294,39 @@ class Writer(object):
                     yield row
 
 
+# Size of deflate history (and so dictionary for parallel compression)
+_deflate_window = 2 ** 15
+
+
+def _deflate_block(level, data, zdict):
+    """
+    Compress `data` as raw deflate stream ended with sync flush
+
+    Return tuple of compressed data, Adler-32 and length of `data`.
+    """
+    try:
+        # 8 is default memLevel
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS,
+                                      8, zlib.Z_DEFAULT_STRATEGY, zdict)
+    except TypeError:
+        # Python < 3.3 has no dictionary support
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data) +\
+        compressor.flush(zlib.Z_SYNC_FLUSH)
+    return compressed, zlib.adler32(data) & 0xFFFFFFFF, len(data)
+
+
+def _adler32_combine(adler1, adler2, len2):
+    """Adler-32 of two joined blocks from checksums of each (as in zlib)"""
+    base = 65521
+    rem = len2 % base
+    sum1 = adler1 & 0xFFFF
+    sum2 = (rem * sum1) % base
+    sum1 += (adler2 & 0xFFFF) + base - 1
+    sum2 += (adler1 >> 16) + (adler2 >> 16) + base - rem
+    return (sum1 % base) | ((sum2 % base) << 16)
+
+
 def write_chunk(outfile, tag, data=bytes()):
     """Write a PNG chunk to the output file, including length and checksum."""
     # http://www.w3.org/TR/PNG/#5Chunk-layout
@@ -1695,12 +2457,21 @@ def interleave_planes(ipixels, apixels, ipsize, apsize):
 
 
 class Filter(BaseFilter):
-    def __init__(self, bitdepth=8, interlace=None, rows=None, prev=None):
+    def __init__(self, bitdepth=8, interlace=None, rows=None, prev=None,
+                 reuse=False):
         BaseFilter.__init__(self, bitdepth)
         if prev is None:
             self.prev = None
         else:
             self.prev = bytearray(prev)
+        self.reuse = reuse
+        # Buffers of `do_filter`: two unfiltered rows which are swapped
+        # (current one and one which is `prev` now) and filtered row
+        # with filter type byte in front.
+        self.cur = None
+        self.last = None
+        self.out = None
+        self.result = None
         self.interlace = interlace
         self.restarts = []
         if self.interlace:
@@ -1757,19 +2528,47 @@ class Filter(BaseFilter):
         `filter_type` may be integer to apply basic filter or
         adaptive strategy with dict
         (`name` is reqired field, others may tune strategy)
+
+        Result is ``bytearray`` with filter type as the first byte.
+        If filter was created with `reuse` basic filters return the same
+        buffer each time, so it should be consumed before next call.
         """
         # Recall that filtering algorithms are applied to bytes,
         # not to pixels, regardless of the bit depth or colour type
         # of the image.
 
-        line = bytearray(line)
+        cur = self.cur
+        if cur is None:
+            cur = newBarray()
+        # Resized only when row length changes (next interlace pass)
+        cur[:] = line
         if isinstance(filter_type, int):
-            res = bytearray(line)
-            self._filter_scanline(filter_type, line, res)
-            res.insert(0, filter_type)  # Add filter type as the first byte
+            out = self.out
+            if out is None or len(out) != len(cur) + 1:
+                out = self.out = newBarray(len(cur) + 1)
+                if _memoryview_cast:
+                    self.result = memoryview(out)[1:]
+                else:
+                    # Python 2 memoryview items are strings
+                    self.result = None
+            out[0] = filter_type  # Filter type as the first byte
+            if self.result is None:
+                res = copyBarray(cur)
+                self._filter_scanline(filter_type, cur, res)
+                out[1:] = res
+            else:
+                out[1:] = cur
+                self._filter_scanline(filter_type, cur, self.result)
+            if self.reuse:
+                res = out
+            else:
+                res = copyBarray(out)
         else:
-            res = self.adaptive_filter(filter_type, line)
-        self.prev = line
+            res = self.adaptive_filter(filter_type, cur)
+        # Swap buffers, row which was `prev` will be overwritten next time
+        self.cur = self.last
+        self.last = cur
+        self.prev = cur
         if self.restarts:
             self.restarts[0] -= 1
             if self.restarts[0] == 0:
@@ -1805,6 +2604,23 @@ def adapt_sum(line, cfg, filter_obj):
 register_extra_filter(adapt_sum, 'sum')
 
 
+def adapt_msad(line, cfg, filter_obj):
+    """Determine best filter by minimal sum of absolute differences"""
+    filter_type = filter_obj._best_filter(line)
+    res = newBarray(len(line) + 1)
+    res[0] = filter_type  # Filter type as the first byte
+    res[1:] = line
+    if _memoryview_cast:
+        filter_obj._filter_scanline(filter_type, line, memoryview(res)[1:])
+    else:
+        # Python 2 memoryview items are strings
+        filtered = copyBarray(line)
+        filter_obj._filter_scanline(filter_type, line, filtered)
+        res[1:] = filtered
+    return res
+register_extra_filter(adapt_msad, 'msad')
+
+
 def adapt_entropy(line, cfg, filter_obj):
     """Determine best filter by dispersion of row values"""
     lines = filter_obj.filter_all(line)
@@ -1860,13 +2676,6 @@ def from_array(a, mode=None, info=None):
     One application of this function is easy PIL-style saving:
     ``png.from_array(pixels, 'L').save('foo.png')``.
 
-    .. note :
-
-      The use of the term *3-dimensional* is for marketing purposes
-      only.  It doesn't actually work.  Please bear with us.  Meanwhile
-      enjoy the complimentary snacks (on request) and please use a
-      2-dimensional array.
-
     Unless they are specified using the *info* parameter, the PNG's
     height and width are taken from the array size.  For a 3 dimensional
     array the first axis is the height; the second axis is the width;
@@ -1985,7 +2794,11 @@ def from_array(a, mode=None, info=None):
     # In order to work out whether we the array is 2D or 3D we need its
     # first row, which requires that we take a copy of its iterator.
     # We may also need the first row to derive width and bitdepth.
-    row, a = peekiter(a)
+    # NumPy array is kept as is for bulk conversion when writing.
+    if _is_ndarray(a):
+        row = a[0]
+    else:
+        row, a = peekiter(a)
     try:
         row[0][0]
         threed = True
@@ -2000,8 +2813,9 @@ def from_array(a, mode=None, info=None):
             width = len(row) // planes
         info['width'] = width
 
-    # Not implemented yet
-    assert not threed
+    if threed and not _is_ndarray(a):
+        # Flatten pixels of each row
+        a = map(lambda row: list(itertools.chain(*row)), a)
 
     if 'bitdepth' not in info:
         try:
@@ -2079,6 +2893,63 @@ class Image(object):
             close()
 
 
+def _decompress(decompressor, chunks, max_length=0):
+    """
+    Iterator that yields decompressed `chunks` in pieces
+
+    Each piece is not longer than `max_length` (when it's not 0).
+    """
+    for data in chunks:
+        while len(data):
+            yield bytearray(decompressor.decompress(data, max_length))
+            data = decompressor.unconsumed_tail
+    # Remaining state is decompressed out.
+    yield bytearray(decompressor.flush())
+
+
+def _prefetch(iterable, size=4):
+    """
+    Iterate over `iterable` on worker thread, up to `size` items ahead.
+
+    Exception raised by `iterable` is re-raised to consumer.  When
+    consumer closes iterator early the worker is stopped and joined.
+    """
+    items = queue.Queue(size)
+    stop = threading.Event()
+
+    def work():
+        """Fill queue, finish with (False, exception or None)"""
+        try:
+            for item in iterable:
+                items.put((True, item))
+                if stop.is_set():
+                    return
+            items.put((False, None))
+        except BaseException:
+            # Including KeyboardInterrupt etc, consumer should not hang
+            items.put((False, sys.exc_info()[1]))
+
+    worker = threading.Thread(target=work)
+    worker.daemon = True
+    worker.start()
+    try:
+        while True:
+            more, item = items.get()
+            if not more:
+                if item is not None:
+                    raise item
+                break
+            yield item
+    finally:
+        stop.set()
+        # Worker may wait for free place in queue
+        while worker.is_alive():
+            try:
+                items.get_nowait()
+            except queue.Empty:
+                worker.join(0.01)
+
+
 class _readable(object):
 
     """A simple file-like interface for strings and arrays."""
@@ -2095,6 +2966,54 @@ class _readable(object):
         self.offset += n
         return r
 
+    def seek(self, offset, whence=0):
+        """Change position in buffer like `file.seek`"""
+        if whence == 1:
+            offset += self.offset
+        elif whence == 2:
+            offset += len(self.buf)
+        self.offset = offset
+
+    def tell(self):
+        """Current position in buffer"""
+        return self.offset
+
+
+class _mmapreadable(_readable):
+
+    """
+    File-like interface for memory mapped file.
+
+    Reading return ``memoryview`` slices of mapped region without copying.
+    Reading starts from current position of `file`.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            view = memoryview(self.map)
+        except TypeError:
+            # Python 2 mmap does not support new buffer protocol
+            self.map.close()
+            raise
+        _readable.__init__(self, view)
+        self.offset = file.tell()
+
+    def unmap(self):
+        """Unmap file, but leave it open"""
+        try:
+            self.buf.release()
+            self.map.close()
+        except BufferError:
+            # Some slices are still in use, leave mapping to GC
+            pass
+
+    def close(self):
+        """Unmap and close file"""
+        self.unmap()
+        self.file.close()
+
 
 class Reader(object):
 
@@ -2114,7 +3033,43 @@ class Reader(object):
           A file-like object (object with a read() method).
         bytes
           ``array`` or ``string`` with PNG data.
+
+        Following keyword options may be added to this argument:
+
+        mmap
+          Map `filename` or `file` (should have fileno() method) into
+          memory.  Chunk data is then read without system calls or
+          copying: ``IDAT`` chunks are returned as ``memoryview`` slices
+          of mapped file.
+        decompress_limit
+          Maximum size of piece of decompressed data processed at once
+          (see :meth:`idatdecomp`).
+        pipeline
+          Read and decompress ``IDAT`` on worker thread ahead of
+          unfiltering and conversion (see :meth:`idatdecomp`).  The
+          file should not be used by other code until image data is
+          read.
+        crc
+          Checksum policy: ``'verify'`` (default) checks all chunks,
+          ``'critical-only'`` checks only ``IHDR``, ``PLTE`` and
+          ``IDAT``, ``'skip'`` does not check anything and
+          ``'lenient'`` checks all chunks but only warns on errors
+          (like `lenient` argument of reading methods).
+        reuse_rows
+          Unfilter straightlaced rows in two preallocated buffers
+          (current and previous row, swapped after each row) instead
+          of new ``bytearray`` for each row.  Rows from :meth:`read` are
+          then ``memoryview`` of these buffers (``bytearray`` itself on
+          Python 2) valid only until next row is requested, so they
+          should be copied if needed later.
         """
+        use_mmap = kw.pop('mmap', False)
+        self.decompress_limit = kw.pop('decompress_limit', None)
+        self.pipeline = kw.pop('pipeline', False)
+        self.crc = kw.pop('crc', 'verify')
+        self.reuse_rows = kw.pop('reuse_rows', False)
+        if self.crc not in ('verify', 'critical-only', 'skip', 'lenient'):
+            raise ValueError("unknown crc policy %r" % self.crc)
         if ((_guess is not None and len(kw) != 0) or
                 (_guess is None and len(kw) != 1)):
             raise TypeError("Reader() takes exactly 1 argument")
@@ -2147,10 +3102,35 @@ class Reader(object):
             self.file = _readable(kw["bytes"])
         else:
             raise TypeError("expecting filename, file or bytes array")
+        if (use_mmap and mmap is not None and memoryview is not None and
+                not isinstance(self.file, _readable)):
+            try:
+                self.file = _mmapreadable(self.file)
+            except (AttributeError, EnvironmentError, ValueError,
+                    TypeError):
+                # Not a real file (or empty one), just read it
+                pass
 
     def __del__(self):
+        # Constructor may fail before file is opened
+        if hasattr(self, 'file'):
+            self._close_file()
+
+    def close(self):
+        """
+        Close file opened by reader.
+
+        File given as `file` argument is left open for caller, only
+        its memory mapping is closed.
+        """
+        self._close_file()
+
+    def _close_file(self):
+        """Close file or memory mapping owned by reader"""
         if self.close_file:
             self.file.close()
+        elif isinstance(self.file, _mmapreadable):
+            self.file.unmap()
 
     def chunk(self, seek=None, lenient=False):
         """
@@ -2176,6 +3156,10 @@ class Reader(object):
                 self.atchunk = self.chunklentype()
             length, chunk_type = self.atchunk
             self.atchunk = None
+            if seek and chunk_type != seek:
+                # Data and checksum are not needed
+                self._skip(length + 4)
+                continue
             data = self.file.read(length)
             if len(data) != length:
                 raise ChunkError('Chunk %s too short for required %i octets.'
@@ -2184,28 +3168,63 @@ class Reader(object):
             if len(checksum) != 4:
                 raise ChunkError('Chunk %s too short for checksum.',
                                  chunk_type)
-            if seek and chunk_type != seek:
-                continue
-            verify = zlib.crc32(strtobytes(chunk_type))
-            verify = zlib.crc32(data, verify)
-            # Whether the output from zlib.crc32 is signed or not varies
-            # according to hideous implementation details, see
-            # http://bugs.python.org/issue1202 .
-            # We coerce it to be positive here (in a way which works on
-            # Python 2.3 and older).
-            verify &= 2**32 - 1
-            verify = struct.pack('!I', verify)
-            if checksum != verify:
-                (a, ) = struct.unpack('!I', checksum)
-                (b, ) = struct.unpack('!I', verify)
-                message = "Checksum error in %s chunk: 0x%08X != 0x%08X." %\
-                                        (chunk_type, a, b)
-                if lenient:
-                    warnings.warn(message, RuntimeWarning)
-                else:
-                    raise ChunkError(message)
+            if chunk_type != 'IDAT' and hasattr(data, 'tobytes'):
+                # Memory mapped data, only IDAT is kept zero-copy
+                data = data.tobytes()
+            if self._crc_needed(chunk_type):
+                verify = zlib.crc32(strtobytes(chunk_type))
+                verify = zlib.crc32(data, verify)
+                self._check_crc(chunk_type, checksum, verify, lenient)
             return chunk_type, data
 
+    def _crc_needed(self, chunk_type):
+        """Whether checksum of `chunk_type` is checked by crc policy"""
+        return self.crc != 'skip' and (self.crc != 'critical-only' or
+                                       chunk_type in ('IHDR', 'PLTE', 'IDAT'))
+
+    def _check_crc(self, chunk_type, checksum, verify, lenient=False):
+        """
+        Compare `checksum` bytes read from file with computed `verify`
+
+        Raise an error or, when `lenient`, warn on mismatch.
+        """
+        # Whether the output from zlib.crc32 is signed or not varies
+        # according to hideous implementation details, see
+        # http://bugs.python.org/issue1202 .
+        # We coerce it to be positive here (in a way which works on
+        # Python 2.3 and older).
+        verify &= 2**32 - 1
+        (checksum, ) = struct.unpack('!I', checksum)
+        if checksum != verify:
+            message = "Checksum error in %s chunk: 0x%08X != 0x%08X." %\
+                                    (chunk_type, checksum, verify)
+            if lenient or self.crc == 'lenient':
+                warnings.warn(message, RuntimeWarning)
+            else:
+                raise ChunkError(message)
+
+    def _skip(self, length):
+        """Skip `length` bytes of input, seeking when possible"""
+        try:
+            if not hasattr(self.file, 'seekable') or self.file.seekable():
+                self.file.seek(length - 1, 1)
+                sought = True
+            else:
+                sought = False
+        except (AttributeError, IOError, OSError, ValueError):
+            # Not seekable stream
+            sought = False
+        if sought:
+            # Seeking beyond the end of file does not fail, reading does
+            if length > 0 and not self.file.read(1):
+                raise ChunkError('End of file whilst skipping chunk.')
+            return
+        while length > 0:
+            data = self.file.read(min(length, 2 ** 16))
+            if not data:
+                raise ChunkError('End of file whilst skipping chunk.')
+            length -= len(data)
+
     def chunks(self):
         """Return an iterator that will yield each chunk as a
         (*chunktype*, *content*) pair.
@@ -2220,8 +3239,26 @@ class Reader(object):
         """
         Read raw pixel data, undo filters, deinterlace, and flatten.
 
+        `raw` may be whole decompressed data (any object with buffer
+        interface) or an iterator that yields it in pieces (like
+        :meth:`idatdecomp`) which are consumed pass by pass, so raw
+        stream is never joined.
+
         Return in flat row flat pixel format.
         """
+        if memoryview is None:
+            # Python 2.6: whole data is copied
+            if isinstance(raw, (bytes, bytearray, array)):
+                raw = [bytearray(raw)]
+        else:
+            try:
+                # Whole data in any buffer
+                raw = [memoryview(raw)]
+            except TypeError:
+                if isinstance(raw, array):
+                    # Python 2 array supports only old buffer interface
+                    raw = [bytearray(raw)]
+                # Otherwise iterator over pieces
         # Values per row (of the target image)
         vpr = self.width * self.planes
 
@@ -2232,9 +3269,69 @@ class Reader(object):
             a = newHarray(vpr * self.height)
         else:
             a = newBarray(vpr * self.height)
-        source_offset = 0
+        for adam7_pass, y, flat in self._iterpasses(raw):
+            self._putpass(a, adam7_pass, y, flat)
+        return a
+
+    def _putpass(self, a, adam7_pass, y, flat):
+        """Put reduced row `flat` of `adam7_pass` into flat image `a`"""
+        xstart, ystart, xstep, ystep = adam7_pass
+        # Values per row (of the target image)
+        vpr = self.width * self.planes
+        end_offset = (y + 1) * vpr
+        if xstep == 1:
+            # Last pass (0, 1, 1, 2))
+            assert xstart == 0
+            offset = y * vpr
+            a[offset:end_offset] = flat
+        else:
+            offset = y * vpr + xstart * self.planes
+            for i in range(self.planes):
+                a[offset + i:end_offset:self.planes * xstep] = \
+                    flat[i::self.planes]
+
+    def _flatrows(self, a):
+        """Iterator over rows of image in flat pixel array `a`"""
+        vpr = self.width * self.planes
+        return (a[offset:offset + vpr] for offset in range(0, len(a), vpr))
+
+    def _iterpasses(self, raw, passes=7):
+        """
+        Iterator that yields reduced rows of Adam7 passes.
+
+        `raw` should be an iterable that yields decompressed data in
+        pieces of arbitrary size; data is consumed pass by pass and
+        nothing after first `passes` passes is requested.
+
+        Yields tuples (*pass*, *y*, *flat*) where *pass* is an item of
+        `_adam7`, *y* is row of target image and *flat* is reduced row
+        in flat pixel format.
+        """
+        raw = iter(raw)
+        a = bytearray()
+        for item in self._passrows(a, passes):
+            if item is not None:
+                yield item
+                continue
+            some = next(raw, None)
+            if some is None:
+                raise FormatError('Not enough data for interlaced image.')
+            a.extend(some)
+
+    def _passrows(self, a, passes=7):
+        """
+        Generator of reduced rows of Adam7 passes decoded from `a`.
+
+        `a` is ``bytearray`` of decompressed data filled by caller: when
+        it does not hold next complete row None is yielded and more data
+        should be appended to `a` before next step.  Used data is removed
+        from the beginning of `a`.  Rows are yielded as by
+        :meth:`_iterpasses`.
+        """
+        offset = 0
         filt = Filter(self.bitdepth * self.planes)
-        for xstart, ystart, xstep, ystep in _adam7:
+        for adam7_pass in _adam7[:passes]:
+            xstart, ystart, xstep, ystep = adam7_pass
             if xstart >= self.width:
                 continue
             # The previous (reconstructed) scanline.  None at the
@@ -2246,27 +3343,90 @@ class Reader(object):
             # Row size in bytes for this pass.
             row_size = int(math.ceil(self.psize * ppr))
             for y in range(ystart, self.height, ystep):
-                filter_type = raw[source_offset]
-                scanline = raw[source_offset + 1:source_offset + row_size + 1]
-                source_offset += (row_size + 1)
+                while len(a) < offset + row_size + 1:
+                    del a[:offset]
+                    offset = 0
+                    yield None
+                filter_type = a[offset]
                 if filter_type not in (0, 1, 2, 3, 4):
                     raise FormatError('Invalid PNG Filter Type.'
                 '  See http://www.w3.org/TR/2003/REC-PNG-20031110/#9Filters .')
+                scanline = a[offset + 1:offset + row_size + 1]
+                offset += row_size + 1
                 filt.undo_filter(filter_type, scanline)
-                # Convert so that there is one element per pixel value
-                flat = self.serialtoflat(scanline, ppr)
-                end_offset = (y + 1) * vpr
-                if xstep == 1:
-                    # Last pass (0, 1, 1, 2))
-                    assert xstart == 0
-                    offset = y * vpr
-                    a[offset:end_offset] = flat
-                else:
-                    offset = y * vpr + xstart * self.planes
-                    for i in range(self.planes):
-                        a[offset + i:end_offset:self.planes * xstep] = \
-                            flat[i::self.planes]
-        return a
+                yield adam7_pass, y, self.serialtoflat(scanline, ppr)
+        del a[:offset]
+
+    def preview(self, passes=1, replicate=True, lenient=False):
+        """
+        Decode preview of interlaced image from first `passes` passes.
+
+        Returns (*width*, *height*, *pixels*, *metadata*) like :meth:`read`.
+        Only data of these passes is decompressed and rest of the file
+        is not read, so a 1/8 scale preview of 1st pass costs about
+        1/64 of full decoding.
+
+        When `replicate` is true result has full image size and each
+        decoded pixel fills the rectangle it stands for until later
+        passes, as in progressive display.  Otherwise reduced image is
+        returned: only decoded grid of pixels (every 8th pixel of every
+        8th row for one pass, every 4th of every 8th for two passes etc).
+        """
+        self.preamble(lenient=lenient)
+        if not self.interlace:
+            raise Error("Preview is available only for interlaced image")
+        if not 1 <= passes <= 7:
+            raise ValueError("passes must be between 1 and 7")
+        planes = self.planes
+        # Values per row (of the target image)
+        vpr = self.width * planes
+        if self.bitdepth > 8:
+            a = newHarray(vpr * self.height)
+        else:
+            a = newBarray(vpr * self.height)
+        for adam7_pass, y, flat in self._iterpasses(self.idatdecomp(lenient),
+                                                    passes):
+            xstart, ystart, xstep, ystep = adam7_pass
+            offset = y * vpr
+            end_offset = offset + vpr
+            if replicate:
+                # Rectangle represented by pixels of this pass
+                block_w, block_h = (xstart or xstep), (ystart or ystep)
+            else:
+                block_w, block_h = 1, 1
+            for dx in range(min(block_w, self.width - xstart)):
+                # Pixels in column xstart + dx of each block
+                count = (self.width - xstart - dx + xstep - 1) // xstep
+                start = offset + (xstart + dx) * planes
+                for i in range(planes):
+                    a[start + i:end_offset:xstep * planes] = \
+                        flat[i:count * planes:planes]
+            for dy in range(1, min(block_h, self.height - y)):
+                a[offset + dy * vpr:end_offset + dy * vpr] = \
+                    a[offset:end_offset]
+        if replicate:
+            width, height = self.width, self.height
+            step_x, step_y = 1, 1
+        else:
+            xstart, ystart, step_x, step_y = _adam7[passes - 1]
+            step_x = xstart or step_x
+            step_y = ystart or step_y
+            width = (self.width + step_x - 1) // step_x
+            height = (self.height + step_y - 1) // step_y
+
+        def iterrows():
+            """Rows of preview as slices of image array"""
+            for y in range(0, self.height, step_y):
+                row = a[y * vpr:(y + 1) * vpr]
+                if step_x > 1:
+                    reduced = row[:width * planes]
+                    for i in range(planes):
+                        reduced[i::planes] = row[i::step_x * planes]
+                    row = reduced
+                yield row
+        meta = self._metadata()
+        meta['size'] = (width, height)
+        return width, height, iterrows(), meta
 
     def iterboxed(self, rows):
         """
@@ -2275,81 +3435,49 @@ class Reader(object):
         `rows` should be an iterator that yields the bytes of
         each row in turn.
         """
+        bitdepth = self.bitdepth
+        if bitdepth == 8:
+            return rows
+        width = self.width * self.planes
+
         def asvalues(raw):
             """
             Convert a row of raw bytes into a flat row.
 
             Result may or may not share with argument
             """
-            if self.bitdepth == 8:
-                return raw
-            if self.bitdepth == 16:
-                raw = bytearray_to_bytes(raw)
-                return array('H', struct.unpack('!%dH' % (len(raw) // 2), raw))
-            assert self.bitdepth < 8
-            width = self.width
-            # Samples per byte
-            spb = 8 // self.bitdepth
-            out = newBarray()
-            mask = 2 ** self.bitdepth - 1
-            #                                      reversed range(spb)
-            shifts = [self.bitdepth * it for it in range(spb - 1, -1, -1)]
-            for o in raw:
-                out.extend([mask & (o >> i) for i in shifts])
-            return out[:width]
+            return unpack_samples(raw, bitdepth, width)
 
         return map(asvalues, rows)
 
     def serialtoflat(self, raw, width=None):
         """Convert serial (byte stream) pixel data to flat row flat pixel."""
-        if self.bitdepth == 8:
-            return raw
-        if self.bitdepth == 16:
-            raw = bytearray_to_bytes(raw)
-            return array('H',
-              struct.unpack('!%dH' % (len(raw) // 2), raw))
-        assert self.bitdepth < 8
         if width is None:
             width = self.width
-        # Samples per byte
-        spb = 8 // self.bitdepth
-        out = newBarray()
-        mask = 2**self.bitdepth - 1
-        #                                      reversed range(spb)
-        shifts = [self.bitdepth * it for it in range(spb - 1, -1, -1)]
-        l = width
-        for o in raw:
-            out.extend([(mask&(o>>s)) for s in shifts][:l])
-            l -= spb
-            if l <= 0:
-                l = width
-        return out
+        return unpack_samples(raw, self.bitdepth, width * self.planes)
 
-    def iterstraight(self, raw):
+    def iterstraight(self, raw, filt=None):
         """
         Iterator that undoes the effect of filtering
 
         Yields each row in serialised format (as a sequence of bytes).
         Assumes input is straightlaced.  `raw` should be an iterable
         that yields the raw bytes in chunks of arbitrary size.
+        `filt` is :class:`Filter` holding previous row when `raw`
+        does not start from the first row.
         """
-        # length of row, in bytes (with filter)
-        rb_1 = self.row_bytes + 1
         a = bytearray()
-        filt = Filter(self.bitdepth * self.planes)
+        if filt is None:
+            filt = Filter(self.bitdepth * self.planes)
+        if self.reuse_rows:
+            # Two buffers are swapped: row being unfiltered and `prev`
+            rows = [bytearray(self.row_bytes), bytearray(self.row_bytes)]
+        else:
+            rows = None
         for some in raw:
             a.extend(some)
-            offset = 0
-            while len(a) >= rb_1 + offset:
-                filter_type = a[offset]
-                if filter_type not in (0, 1, 2, 3, 4):
-                    raise FormatError('Invalid PNG Filter Type.'
-                '  See http://www.w3.org/TR/2003/REC-PNG-20031110/#9Filters .')
-                scanline = a[offset + 1:offset + rb_1]
-                filt.undo_filter(filter_type, scanline)
+            for scanline in self._splitrows(a, filt, rows):
                 yield scanline
-                offset += rb_1
-            del a[:offset]
 
         if len(a) != 0:
             # :file:format We get here with a file format error:
@@ -2359,11 +3487,75 @@ class Reader(object):
               'Wrong size for decompressed IDAT chunk.')
         assert len(a) == 0
 
+    def _splitrows(self, a, filt, rows=None):
+        """
+        Iterator that undoes filtering of complete rows in `a`
+
+        `a` is ``bytearray`` of raw (decompressed) straightlaced data;
+        rows are yielded in serialised format and removed from `a` when
+        iterator is exhausted, incomplete row is left for more data.
+        `filt` is :class:`Filter` holding previous row.
+        When `rows` is list of two buffers every row is unfiltered in one
+        of them and the other one is previous row of `filt`, so rows are
+        yielded as views of these buffers instead of new ``bytearray``.
+        Buffers are swapped after each row (first one is the next to fill).
+        """
+        # length of row, in bytes (with filter)
+        rb_1 = self.row_bytes + 1
+        offset = 0
+        if rows is None:
+            source = None
+        else:
+            if memoryview is None:
+                # Python 2.6: rows are copied from slices
+                source = a
+            else:
+                source = memoryview(a)
+            if _memoryview_cast:
+                views = [memoryview(rows[0]), memoryview(rows[1])]
+            else:
+                # Python 2 memoryview items are strings
+                views = list(rows)
+        try:
+            while len(a) >= rb_1 + offset:
+                filter_type = a[offset]
+                if filter_type not in (0, 1, 2, 3, 4):
+                    raise FormatError('Invalid PNG Filter Type.'
+                '  See http://www.w3.org/TR/2003/REC-PNG-20031110/#9Filters .')
+                if source is None:
+                    scanline = a[offset + 1:offset + rb_1]
+                    filt.undo_filter(filter_type, scanline)
+                    yield scanline
+                else:
+                    row = rows[0]
+                    piece = source[offset + 1:offset + rb_1]
+                    row[:] = piece
+                    if hasattr(piece, 'release'):
+                        piece.release()
+                    # Python 2 view can't be released, only dropped
+                    del piece
+                    filt._undo_filter(filter_type, row)
+                    # Unfiltered row becomes `prev` without copying
+                    filt.prev = row
+                    rows.reverse()
+                    views.reverse()
+                    yield views[1]
+                offset += rb_1
+        finally:
+            # `a` can not be resized while exported to memoryview
+            if hasattr(source, 'release'):
+                source.release()
+            source = None
+        del a[:offset]
+
     def validate_signature(self):
         """If signature (header) has not been read then read and validate it"""
         if self.signature:
             return
         self.signature = self.file.read(8)
+        if memoryview is not None and isinstance(self.signature, memoryview):
+            # Copied, so memory mapped file could be closed
+            self.signature = self.signature.tobytes()
         if self.signature != png_signature:
             raise FormatError("PNG file has invalid signature.")
 
@@ -2627,19 +3819,148 @@ class Reader(object):
                 warnings.warn("PLTE chunk is required before IDAT chunk")
             yield data
 
-    def idatdecomp(self, lenient=False, max_length=0):
-        """Iterator that yields decompressed ``IDAT`` strings."""
-        # Currently, with no max_length paramter to decompress, this
-        # routine will do one yield per IDAT chunk.  So not very
-        # incremental.
+    def idatdecomp(self, lenient=False, max_length=None):
+        """
+        Iterator that yields decompressed ``IDAT`` strings.
+
+        Each string is no longer than `max_length` bytes (0 means no
+        limit, ``None`` - limit specified when creating reader), so
+        memory used does not depend on compression ratio.
+
+        When reader was created with `pipeline` option data is read and
+        decompressed on worker thread a few pieces ahead, so file input
+        and zlib (which releases GIL) overlap with processing of rows.
+        """
+        if max_length is None:
+            max_length = self.decompress_limit
+            if max_length is None:
+                # A few rows but not too small pieces
+                max_length = max(2 ** 16, 4 * (self.row_bytes + 1))
+        raw = _decompress(zlib.decompressobj(), self.idat(lenient),
+                          max_length)
+        if self.pipeline and threading is not None:
+            raw = _prefetch(raw)
+        return raw
+
+    def _idat_located(self, lenient=False):
+        """
+        Iterator that yields all the ``IDAT`` chunks with their location
+
+        Yields (*offset*, *length*, *data*) where *offset* is position of
+        chunk data in file.
+        """
+        while True:
+            if not self.atchunk:
+                self.atchunk = self.chunklentype()
+                if self.atchunk is None:
+                    raise ChunkError('End of file whilst reading IDAT.')
+            offset = self.file.tell()
+            length = self.atchunk[0]
+            chunk_type, data = self.chunk(lenient=lenient)
+            if chunk_type == 'IEND':
+                break
+            if chunk_type == 'IDAT':
+                yield offset, length, data
+
+    def build_index(self, step=512, lenient=False):
+        """
+        Build index for random access to rows of straightlaced image.
+
+        Whole image is decoded once and every `step` rows a checkpoint
+        is recorded: position in file, copy of decompressor and previous
+        (reconstructed) row.  Index is stored as ``row_index`` attribute
+        and returned; it can be passed to :meth:`rows` of another
+        :class:`Reader` of the same file.  Input file should be seekable.
+
+        Checkpoints hold live ``zlib`` decompressor objects, so index
+        can not be pickled or saved to disk, it's only usable in memory
+        of the process which built it.
+        """
+        if not hasattr(self, 'row_bytes'):
+            self.preamble(lenient=lenient)
+        if self.interlace:
+            raise Error("Random access to interlaced image rows"
+                        " is not supported")
+        rb_1 = self.row_bytes + 1
         d = zlib.decompressobj()
-        # Each IDAT chunk is passed to the decompressor, then any
-        # remaining state is decompressed out.
-        for data in self.idat(lenient):
-            # :todo: add a max_length argument here to limit output
-            # size.
-            yield bytearray(d.decompress(data))
-        yield bytearray(d.flush())
+        filt = Filter(self.bitdepth * self.planes)
+        a = bytearray()
+        row = 0
+        index = []
+        for offset, length, data in self._idat_located(lenient):
+            if not index:
+                index.append((0, offset, length, 0, d.copy(), bytes(), None))
+            while len(data):
+                # Row at a time so checkpoint falls close to its mark
+                a.extend(d.decompress(data, rb_1))
+                data = d.unconsumed_tail
+                rowstart = row
+                offset_a = 0
+                while len(a) >= rb_1 + offset_a:
+                    filter_type = a[offset_a]
+                    if filter_type not in (0, 1, 2, 3, 4):
+                        raise FormatError('Invalid PNG Filter Type.'
+                '  See http://www.w3.org/TR/2003/REC-PNG-20031110/#9Filters .')
+                    filt.undo_filter(filter_type,
+                                     a[offset_a + 1:offset_a + rb_1])
+                    offset_a += rb_1
+                    row += 1
+                del a[:offset_a]
+                if row // step != rowstart // step and row < self.height:
+                    index.append((row, offset, length,
+                                  length - len(data), d.copy(), bytes(a),
+                                  bytes(bytearray(filt.prev))))
+        self.row_index = index
+        return index
+
+    def rows(self, start=0, stop=None, index=None, lenient=False):
+        """
+        Iterator over rows from `start` to `stop` of straightlaced image.
+
+        Decoding is resumed from nearest checkpoint of `index`
+        (see :meth:`build_index`) so only rows after it are decoded.
+        When no `index` is given ``row_index`` of this reader is used,
+        building it first if necessary.
+
+        Yields rows in boxed row flat pixel format.
+        """
+        if index is None:
+            index = getattr(self, 'row_index', None)
+            if index is None:
+                index = self.build_index(lenient=lenient)
+        elif not hasattr(self, 'row_bytes'):
+            self.preamble(lenient=lenient)
+        if stop is None or stop > self.height:
+            stop = self.height
+        start = min(max(start, 0), stop)
+        checkpoint = index[0]
+        for it in index:
+            if it[0] > start:
+                break
+            checkpoint = it
+        row, offset, length, consumed, decomp, pending, prev = checkpoint
+        # Decompressor copy may be resumed from any reader many times
+        d = decomp.copy()
+        filt = Filter(self.bitdepth * self.planes, prev=prev)
+
+        def iterdata():
+            """Compressed data starting from checkpoint"""
+            self.file.seek(offset + consumed)
+            data = self.file.read(length - consumed)
+            # CRC could not be verified for partially read chunk
+            self.file.read(4)
+            self.atchunk = None
+            yield data
+            for data in self.idat(lenient):
+                yield data
+        raw = self.iterstraight(itertools.chain(
+            [pending], _decompress(d, iterdata(), self.row_bytes + 1)), filt)
+        try:
+            for _ in range(row, start):
+                next(raw)
+        except StopIteration:
+            raise FormatError("Image data ends before row %d." % start)
+        return self.iterboxed(itertools.islice(raw, max(stop - start, 0)))
 
     def read(self, lenient=False):
         """
@@ -2658,14 +3979,13 @@ class Reader(object):
         raw = self.idatdecomp(lenient)
 
         if self.interlace:
-            raw = bytearray(itertools.chain(*raw))
-            arraycode = 'BH'[self.bitdepth > 8]
-            # Like :meth:`group` but producing an array.array object for
-            # each row.
-            pixels = map(lambda *row: array(arraycode, row),
-                       *[iter(self.deinterlace(raw))]*self.width*self.planes)
+            pixels = self._flatrows(self.deinterlace(raw))
         else:
             pixels = self.iterboxed(self.iterstraight(raw))
+        return self.width, self.height, pixels, self._metadata()
+
+    def _metadata(self):
+        """Metadata dictionary as returned by :meth:`read`"""
         meta = dict()
         for attr in 'greyscale alpha planes bitdepth interlace'.split():
             meta[attr] = getattr(self, attr)
@@ -2678,7 +3998,62 @@ class Reader(object):
                 meta[attr] = a
         if self.plte:
             meta['palette'] = self.palette()
-        return self.width, self.height, pixels, meta
+        return meta
+
+    def read_region(self, x, y, width, height, lenient=False):
+        """
+        Read rectangular region of the PNG file and decode it.
+
+        Returns (`width`, `height`, `pixels`, `metadata`) as :meth:`read`
+        does, but for region with top left corner at (`x`, `y`) and size
+        `width` x `height`.
+
+        Rows above the region are only unfiltered, reading stops after
+        the bottom edge of region and only bytes of region are unpacked
+        in each row.  Interlaced images are decoded completely and then
+        cropped.
+        """
+        self.preamble(lenient=lenient)
+        if x < 0 or y < 0 or width <= 0 or height <= 0 or\
+                x + width > self.width or y + height > self.height:
+            raise ValueError("region (%d, %d, %d, %d) is out of image" %
+                             (x, y, width, height))
+        if self.interlace:
+            start = x * self.planes
+            stop = (x + width) * self.planes
+
+            def itercrop(rows):
+                """Cut region from each row"""
+                for row in rows:
+                    yield row[start:stop]
+            pixels = itercrop(itertools.islice(self.read(lenient)[2],
+                                               y, y + height))
+        else:
+            rows = itertools.islice(
+                self.iterstraight(self.idatdecomp(lenient)), y, y + height)
+            bitdepth = self.bitdepth
+            if bitdepth >= 8:
+                start = x * self.psize
+                stop = (x + width) * self.psize
+                skip = 0
+            else:
+                # Only greyscale or palette, so sample is pixel
+                spb = 8 // bitdepth
+                start = x // spb
+                stop = (x + width + spb - 1) // spb
+                skip = x % spb
+
+            def itercrop(rows):
+                """Cut and unpack bytes of region from each row"""
+                for row in rows:
+                    row = unpack_samples(row[start:stop], bitdepth)
+                    if bitdepth < 8:
+                        row = row[skip:skip + width]
+                    yield row
+            pixels = itercrop(rows)
+        meta = self._metadata()
+        meta['size'] = (width, height)
+        return width, height, pixels, meta
 
     def read_flat(self):
         """
@@ -2693,11 +4068,154 @@ class Reader(object):
         See also the :meth:`read` method which returns pixels in the
         more stream-friendly boxed row flat pixel format.
         """
+        self.preamble()
+        arraycode = 'BH'[self.bitdepth > 8]
+        if _memoryview_cast:
+            pixel = array(arraycode, [0]) * (
+                self.width * self.height * self.planes)
+            meta = self.readinto(pixel)
+            return self.width, self.height, pixel, meta
         x, y, pixel, meta = self.read()
-        arraycode = 'BH'[meta['bitdepth'] > 8]
         pixel = array(arraycode, itertools.chain(*pixel))
         return x, y, pixel, meta
 
+    def readinto(self, buffer, stride=None, lenient=False):
+        """
+        Read a PNG file and decode it into `buffer`.
+
+        Returns `metadata` (as :meth:`read`).
+
+        `buffer` may be any writable object supporting buffer protocol
+        (``bytearray``, ``mmap``, ``array``, NumPy array...).  Samples
+        are written unpacked: one byte per sample for bitdepth up to 8
+        and two bytes in native byte order for bitdepth 16.  Rows are
+        `stride` bytes apart, by default they follow each other without
+        gaps.
+
+        Rows of interlaced image are scattered into `buffer` right from
+        each pass, so the image is never built elsewhere.  On Python 2
+        (where ``memoryview`` can't be sliced with step) interlaced
+        image is decoded as by :meth:`read` and then copied; ``array``
+        there should have item of sample size.
+        """
+        self.preamble(lenient=lenient)
+        size = 1 + (self.bitdepth > 8)
+        # Bytes per pixel
+        px = self.planes * size
+        row_len = self.width * px
+        if stride is None:
+            stride = row_len
+        elif stride < row_len:
+            raise ValueError("stride is less than row of %d bytes" % row_len)
+        try:
+            if memoryview is None:
+                raise TypeError("memoryview is not available")
+            view = memoryview(buffer)
+        except TypeError:
+            if memoryview is None and isinstance(buffer, bytearray):
+                # Python 2.6: bytearray is written by slices as view
+                view = buffer
+                buffer_len = len(buffer)
+            elif isinstance(buffer, array):
+                # Python 2 array supports only old buffer interface
+                if buffer.itemsize != size or stride % size:
+                    raise ValueError("array item or stride does not match"
+                                     " %d byte samples" % size)
+                view = None
+                buffer_len = len(buffer) * size
+            else:
+                raise
+        else:
+            if view.readonly:
+                raise TypeError("buffer is not writable")
+            if _memoryview_cast:
+                view = view.cast('B')
+            buffer_len = len(view)
+        if buffer_len < stride * (self.height - 1) + row_len:
+            raise ValueError("buffer is too small for %dx%d image" %
+                             (self.width, self.height))
+        if self.interlace and _memoryview_cast:
+            passes = self._iterpasses(self.idatdecomp(lenient))
+            for (xstart, ystart, xstep, ystep), y, flat in passes:
+                if size > 1:
+                    flat = memoryview(flat).cast('B')
+                offset = y * stride + xstart * px
+                end = y * stride + row_len
+                # Every byte of pixel goes with its own step
+                for i in range(px):
+                    view[offset + i:end:px * xstep] = flat[i::px]
+            return self._metadata()
+        offset = 0
+        for row in self.read(lenient)[2]:
+            if view is None:
+                buffer[offset // size:(offset + row_len) // size] = \
+                    array(buffer.typecode, row)
+            elif _memoryview_cast:
+                if size > 1:
+                    row = memoryview(row).cast('B')
+                view[offset:offset + row_len] = row
+            else:
+                if size > 1:
+                    row = row.tostring()
+                view[offset:offset + row_len] = row
+            offset += stride
+        return self._metadata()
+
+    def as_ndarray(self, mode='native'):
+        """
+        Read and decode image into NumPy array of shape (height, width,
+        planes).
+
+        `mode` selects representation of samples:
+
+        ``'native'``
+          samples as stored (like :meth:`read`), palette indices for
+          colour type 3
+        ``'direct'``
+          like :meth:`asDirect`
+        ``'L'``, ``'LA'``, ``'RGB'``, ``'RGBA'``
+          converted channels (like :meth:`asRGB`) with bitdepth kept or
+          rescaled when mode is followed by it (``'RGB8'``, ``'LA16'``)
+        ``'float'``
+          like :meth:`asFloat` with ``maxval`` 1.0
+
+        Array is allocated once with ``uint8`` samples for bitdepth up to
+        8, native-endian ``uint16`` for larger bitdepth or ``float64``,
+        and each row is decoded directly into it.
+        """
+        if _import_numpy() is None:
+            raise ImportError("NumPy is required for as_ndarray")
+        self.preamble()
+        if mode == 'native':
+            dtype = ('=u1', '=u2')[self.bitdepth > 8]
+            a = numpy.empty((self.height, self.width, self.planes), dtype)
+            self.readinto(a)
+            return a
+        if mode == 'direct':
+            width, height, pixels, meta = self.asDirect()
+        elif mode == 'float':
+            width, height, pixels, meta = self.asFloat()
+        else:
+            channels = mode.rstrip('0123456789')
+            bitdepth = mode[len(channels):]
+            if channels not in ('L', 'LA', 'RGB', 'RGBA') or \
+                    bitdepth not in ('', '8', '16'):
+                raise ValueError("unknown mode %r" % mode)
+            width, height, pixels, meta = self._convert(
+                channels, bitdepth and int(bitdepth) or None)
+        if 'maxval' in meta:
+            dtype = numpy.float64
+        else:
+            dtype = ('=u1', '=u2')[meta['bitdepth'] > 8]
+        a = numpy.empty((height, width, meta['planes']), dtype)
+        rows = a.reshape(height, -1)
+        for y, row in enumerate(pixels):
+            if isinstance(row, list):
+                rows[y] = row
+            else:
+                rows[y] = numpy.frombuffer(row, dtype)
+        return a
+
     def palette(self, alpha='natural'):
         """
         Returns a palette that is a sequence of 3-tuples or 4-tuples
@@ -2722,7 +4240,7 @@ class Reader(object):
             plte = list(map(operator.add, plte, group(trns, 1)))
         return plte
 
-    def asDirect(self):
+    def asDirect(self, region=None):
         """Returns the image data as a direct representation of an
         ``x * y * planes`` array.  This method is intended to remove the
         need for callers to deal with palettes and transparency
@@ -2758,123 +4276,195 @@ class Reader(object):
         like the :meth:`read` method).
 
         All the other aspects of the image data are not changed.
+
+        If `region` is specified as tuple (*x*, *y*, *width*, *height*)
+        only this part of the image is decoded (see :meth:`read_region`).
         """
+        x, y, pixels, meta = self._direct(region)
+        targetbitdepth = self._sbit_depth(meta['bitdepth'])
+        if targetbitdepth:
+            sourcebitdepth = meta['bitdepth']
+            shift = sourcebitdepth - targetbitdepth
+            meta['bitdepth'] = targetbitdepth
+            pixels = map(lambda row: shift_samples(row, sourcebitdepth,
+                                                   shift),
+                         pixels)
+        return x, y, pixels, meta
+
+    def _sbit_depth(self, bitdepth):
+        """
+        Significant bit depth from ``sBIT`` chunk.
+
+        Returns None when there is no ``sBIT`` chunk or it does not
+        reduce `bitdepth`.
+        """
+        if not self.sbit:
+            return None
+        sbit = struct.unpack('%dB' % len(self.sbit), self.sbit)
+        targetbitdepth = max(sbit)
+        if targetbitdepth > bitdepth:
+            raise Error('sBIT chunk %r exceeds bitdepth %d' %
+                (sbit, self.bitdepth))
+        if min(sbit) <= 0:
+            raise Error('sBIT chunk %r has a 0-entry' % sbit)
+        if targetbitdepth == bitdepth:
+            return None
+        return targetbitdepth
+
+    def _direct(self, region=None):
+        """Like :meth:`asDirect`, but ``sBIT`` chunk is not applied"""
         self.preamble()
+        if region is None:
+            read = self.read
+        else:
+            def read():
+                return self.read_region(*region)
         # Simple case, no conversion necessary.
-        if not self.colormap and not self.trns and not self.sbit:
-            return self.read()
-
-        x, y, pixels, meta = self.read()
+        if not self.colormap and not self.trns:
+            return read()
+
+        if self.colormap and region is None and not self.interlace:
+            # Palette is applied to packed rows, indices are not unpacked
+            x, y, meta = self.width, self.height, self._metadata()
+            pixels = self.iterstraight(self.idatdecomp())
+            bitdepth = self.bitdepth
+        else:
+            x, y, pixels, meta = read()
+            bitdepth = 8
 
         if self.colormap:
             meta['colormap'] = False
             meta['alpha'] = bool(self.trns)
             meta['bitdepth'] = 8
             meta['planes'] = 3 + bool(self.trns)
-            plte = self.palette()
-
-            def iterpal(pixels):
-                for row in pixels:
-                    row = [plte[i] for i in row]
-                    yield bytearray(itertools.chain(*row))
-            pixels = iterpal(pixels)
+            pixels = map(palette_expander(self.palette(), bitdepth, x),
+                         pixels)
         elif self.trns:
-            # It would be nice if there was some reasonable way
-            # of doing this without generating a whole load of
-            # intermediate tuples.  But tuples does seem like the
-            # easiest way, with no other way clearly much simpler or
-            # much faster.  (Actually, the L to LA conversion could
-            # perhaps go faster (all those 1-tuples!), but I still
-            # wonder whether the code proliferation is worth it)
-            it = self.transparent
-            maxval = 2**meta['bitdepth'] - 1
             planes = meta['planes']
+            bitdepth = meta['bitdepth']
             meta['alpha'] = True
             meta['planes'] += 1
-            if meta['bitdepth'] > 8:
-                def wrap_array(row):
-                    return array('H', row)
-            else:
-                wrap_array = bytearray
+            pixels = map(lambda row: trns_alpha(row, planes, bitdepth,
+                                                self.transparent),
+                         pixels)
+        return x, y, pixels, meta
+
+    def _convert(self, mode=None, bitdepth=None, maxval=None):
+        """
+        Return image converted in a single pass over each row.
+
+        `mode` is one of ``'L'``, ``'LA'``, ``'RGB'``, ``'RGBA'`` or None
+        to keep channels of :meth:`asDirect`; `bitdepth` is target bit
+        depth (None to keep bit depth of :meth:`asDirect`).  When
+        `maxval` is given samples are floats from 0.0 to `maxval`.
+
+        Conversion is planned once from format of the image: palette
+        and ``tRNS`` are applied as by :meth:`asDirect`, while ``sBIT``
+        shift and rescaling are folded into one lookup table which is
+        applied to every channel (with ``translate`` when possible) and
+        written directly to its place in a new row.
+        """
+        width, height, pixels, meta = self._direct()
+        source = meta['bitdepth']
+        depth = self._sbit_depth(source) or source
+        shift = source - depth
+        source_greyscale, source_alpha = meta['greyscale'], meta['alpha']
+        greyscale, alpha = source_greyscale, source_alpha
+        if mode is not None:
+            if mode not in ('L', 'LA', 'RGB', 'RGBA'):
+                raise ValueError("unknown mode %r" % mode)
+            if source_alpha and not mode.endswith('A'):
+                raise Error("will not convert image with alpha channel "
+                            "to %s" % mode)
+            if not source_greyscale and mode.startswith('L'):
+                raise Error("will not convert colour image to %s" % mode)
+            greyscale, alpha = mode.startswith('L'), mode.endswith('A')
+        if bitdepth is None:
+            bitdepth = depth
+        source_planes = meta['planes']
+        planes = (3, 1)[greyscale] + alpha
+        if maxval is not None:
+            targetmaxval = float(maxval)
+        else:
+            targetmaxval = 2 ** bitdepth - 1
+        factor = targetmaxval / float(2 ** depth - 1)
+
+        # Plan of values mapping
+        if maxval is None and factor == 1 and not shift:
+            lut = None
+
+            def mapped(values):
+                return values
+        elif maxval is not None:
+            lut = [(it >> shift) * factor for it in range(2 ** source)]
 
-            def itertrns(pixels):
+            def mapped(values):
+                return list(map(lut.__getitem__, values))
+        else:
+            lut = rescale_lut(source, bitdepth, shift)
+
+            def mapped(values):
+                return rescale_samples(values, source, bitdepth, shift)
+
+        # Plan of channels layout
+        length = width * planes
+        if maxval is not None:
+            template = [targetmaxval] * length
+        elif bitdepth > 8:
+            template = array('H', [targetmaxval]) * length
+        else:
+            template = bytearray([targetmaxval]) * length
+        if greyscale == source_greyscale and alpha == source_alpha:
+            def iterconvert():
                 for row in pixels:
-                    # For each row we group it into pixels, then form a
-                    # characterisation vector that says whether each
-                    # pixel is opaque or not.  Then we convert
-                    # True/False to 0/maxval (by multiplication),
-                    # and add it as the extra channel.
-                    row = group(row, planes)
-                    opa = [maxval * (it != i) for i in row]
-                    opa = zip(opa)  # convert to 1-tuples
-                    yield wrap_array(itertools.chain(*list(map(operator.add,
-                                                               row, opa))))
-            pixels = itertrns(pixels)
-        targetbitdepth = None
-        if self.sbit:
-            sbit = struct.unpack('%dB' % len(self.sbit), self.sbit)
-            targetbitdepth = max(sbit)
-            if targetbitdepth > meta['bitdepth']:
-                raise Error('sBIT chunk %r exceeds bitdepth %d' %
-                    (sbit, self.bitdepth))
-            if min(sbit) <= 0:
-                raise Error('sBIT chunk %r has a 0-entry' % sbit)
-            if targetbitdepth == meta['bitdepth']:
-                targetbitdepth = None
-        if targetbitdepth:
-            shift = meta['bitdepth'] - targetbitdepth
-            meta['bitdepth'] = targetbitdepth
+                    yield mapped(row)
+        elif (planes == 4 and bitdepth <= 8 and maxval is None and
+                not issubclass(BaseFilter, iBaseFilter)):
+            # Compiled filters expand rows to RGBA in one loop
+            convert = getattr(BaseFilter(), ('convert_l_to_rgba',
+                                             'convert_la_to_rgba',
+                                             'convert_rgb_to_rgba')
+                              [source_planes - 1])
+
+            def iterconvert():
+                for row in pixels:
+                    out = template[:]
+                    convert(mapped(row), out)
+                    yield out
+        else:
+            colour_planes = (3, 1)[greyscale]
 
-            def itershift(pixels):
+            def iterconvert():
                 for row in pixels:
-                    yield array('BH'[targetbitdepth > 8],
-                                [it >> shift for it in row])
-            pixels = itershift(pixels)
-        return x, y, pixels, meta
+                    out = template[:]
+                    values = mapped(row[0::source_planes])
+                    for i in range(colour_planes):
+                        if i and not source_greyscale:
+                            values = mapped(row[i::source_planes])
+                        out[i::planes] = values
+                    if source_alpha:
+                        out[planes - 1::planes] = \
+                            mapped(row[source_planes - 1::source_planes])
+                    yield out
+
+        if lut is not None and maxval is None and 'transparent' in meta:
+            meta['transparent'] = tuple(
+                [lut[it] for it in meta['transparent']])
+        meta['greyscale'], meta['alpha'] = greyscale, alpha
+        meta['planes'] = planes
+        if maxval is not None:
+            del meta['bitdepth']
+            meta['maxval'] = targetmaxval
+        else:
+            meta['bitdepth'] = bitdepth
+        return width, height, iterconvert(), meta
 
     def asFloat(self, maxval=1.0):
         """Return image pixels as per :meth:`asDirect` method, but scale
         all pixel values to be floating point values between 0.0 and
         *maxval*.
         """
-        x, y, pixels, info = self.asDirect()
-        sourcemaxval = 2**info['bitdepth'] - 1
-        del info['bitdepth']
-        info['maxval'] = float(maxval)
-        factor = float(maxval) / float(sourcemaxval)
-
-        def iterfloat():
-            for row in pixels:
-                yield [factor * it for it in row]
-        return x, y, iterfloat(), info
-
-    def _as_rescale(self, get, targetbitdepth):
-        """Helper used by :meth:`asRGB8` and :meth:`asRGBA8`."""
-        width, height, pixels, meta = get()
-        maxval = 2**meta['bitdepth'] - 1
-        targetmaxval = 2**targetbitdepth - 1
-        factor = float(targetmaxval) / float(maxval)
-        meta['bitdepth'] = targetbitdepth
-
-        def iterscale(rows):
-            for row in rows:
-                yield array('BH'[targetbitdepth > 8],
-                            [int(round(x * factor)) for x in row])
-        if maxval == targetmaxval:
-            return width, height, pixels, meta
-        else:
-            if 'transparent' in meta:
-                transparent = meta['transparent']
-                if isinstance(transparent, tuple):
-                    transparent = tuple(list(
-                                        iterscale((transparent,))
-                                        )[0])
-                else:
-                    transparent = tuple(list(
-                                        iterscale(((transparent,),))
-                                        )[0])[0]
-                meta['transparent'] = transparent
-            return width, height, iterscale(pixels), meta
+        return self._convert(maxval=maxval)
 
     def asRGB8(self):
         """
@@ -2896,7 +4486,7 @@ class Reader(object):
 
         *pixels* is the pixel data in boxed row flat pixel format.
         """
-        return self._as_rescale(self.asRGB, 8)
+        return self._convert('RGB', 8)
 
     def asRGBA8(self):
         """
@@ -2907,7 +4497,7 @@ class Reader(object):
         values are rescaled to the range 0 to 255.  The alpha channel is
         synthesized if necessary (with a small speed penalty).
         """
-        return self._as_rescale(self.asRGBA, 8)
+        return self._convert('RGBA', 8)
 
     def asRGB(self):
         """
@@ -2924,21 +4514,7 @@ class Reader(object):
         source image.  In particular, for this method
         ``metadata['greyscale']`` will be ``False``.
         """
-        width, height, pixels, meta = self.asDirect()
-        if meta['alpha']:
-            raise Error("will not convert image with alpha channel to RGB")
-        if not meta['greyscale']:
-            return width, height, pixels, meta
-        meta['greyscale'] = False
-        newarray = (newBarray, newHarray)[meta['bitdepth'] > 8]
-
-        def iterrgb():
-            for row in pixels:
-                a = newarray(3 * width)
-                for i in range(3):
-                    a[i::3] = row
-                yield a
-        return width, height, iterrgb(), meta
+        return self._convert('RGB')
 
     def asRGBA(self):
         """
@@ -2952,52 +4528,348 @@ class Reader(object):
         ``metadata['greyscale']`` will be ``False``, and
         ``metadata['alpha']`` will be ``True``.
         """
-        width, height, pixels, meta = self.asDirect()
-        if meta['alpha'] and not meta['greyscale']:
-            return width, height, pixels, meta
-        maxval = 2**meta['bitdepth'] - 1
-        if meta['bitdepth'] > 8:
-            def newarray():
-                return array('H', [maxval] * 4 * width)
-        else:
-            def newarray():
-                return bytearray([maxval] * 4 * width)
+        return self._convert('RGBA')
 
-        # Not best way, but we have only array of bytes accelerated now
-        if meta['bitdepth'] <= 8:
-            filt = BaseFilter()
-        else:
-            filt = iBaseFilter()
 
-        if meta['alpha'] and meta['greyscale']:
-            # LA to RGBA
-            def convert():
-                for row in pixels:
-                    # Create a fresh target row, then copy L channel
-                    # into first three target channels, and A channel
-                    # into fourth channel.
-                    a = newarray()
-                    filt.convert_la_to_rgba(row, a)
-                    yield a
-        elif meta['greyscale']:
-            # L to RGBA
-            def convert():
-                for row in pixels:
-                    a = newarray()
-                    filt.convert_l_to_rgba(row, a)
-                    yield a
+def _pull_method(name):
+    """Method of :class:`Reader` which reads file, :class:`Decoder` has none"""
+    def method(self, *args, **kw):
+        raise Error("Decoder has no %s(), use rows returned by feed()" % name)
+    method.__name__ = name
+    return method
+
+
+class Decoder(Reader):
+
+    """
+    Push-style PNG decoder.
+
+    Data is given to :meth:`feed` in pieces of any size as it arrives
+    (from network for example) and decoded rows are returned as soon as
+    they are complete.  Chunks are processed as by :class:`Reader`, and
+    its attributes (`width`, `height`, `bitdepth` ...) are set once the
+    chunks before image data are fed.  Only incomplete chunk (or row)
+    is buffered; ``IDAT`` data is decompressed and unfiltered as it
+    comes, rows of interlaced image are put into the image right from
+    their passes.
+    """
+
+    def __init__(self, **kw):
+        """
+        Create a decoder.
+
+        Keyword options are as for :class:`Reader` (`crc`,
+        `decompress_limit`), others raise ``TypeError``.
+        """
+        for name in kw:
+            if name not in ('crc', 'decompress_limit'):
+                raise TypeError("Decoder() got unsupported argument %r"
+                                % name)
+        Reader.__init__(self, file=None, **kw)
+        # Received data which is not processed yet
+        self.buf = bytearray()
+        # What is expected next: 'signature', 'header' (chunk length and
+        # type), 'data' (of non-IDAT chunk with its checksum), 'idat'
+        # (IDAT data), 'checksum' (of IDAT) or 'end' (after IEND)
+        self.state = 'signature'
+        # Remaining length of IDAT data and checksum of its part
+        self.remaining = 0
+        self.verify = 0
+        # Warn on checksum errors instead of raising
+        self.lenient = False
+        self.decompressor = zlib.decompressobj()
+        # Decompressed data which does not form complete row
+        self.raw = bytearray()
+        # Interlaced image and generator of rows of its passes
+        self.image = None
+        self.passrows = None
+        self.filt = None
+
+    # Methods of Reader which pull data from file raise Error
+    preamble = _pull_method('preamble')
+    read = _pull_method('read')
+    read_flat = _pull_method('read_flat')
+    read_region = _pull_method('read_region')
+    readinto = _pull_method('readinto')
+    as_ndarray = _pull_method('as_ndarray')
+    asDirect = _pull_method('asDirect')
+    asFloat = _pull_method('asFloat')
+    asRGB = _pull_method('asRGB')
+    asRGBA = _pull_method('asRGBA')
+    asRGB8 = _pull_method('asRGB8')
+    asRGBA8 = _pull_method('asRGBA8')
+    preview = _pull_method('preview')
+    rows = _pull_method('rows')
+    build_index = _pull_method('build_index')
+    chunks = _pull_method('chunks')
+
+    def feed(self, data):
+        """
+        Decode next piece of PNG data.
+
+        Returns list of rows (in boxed row flat pixel format) which were
+        completed by this piece.  Rows of interlaced image are returned
+        only by :meth:`close`.
+        """
+        self.buf.extend(data)
+        rows = []
+        while True:
+            if self.state == 'signature':
+                if len(self.buf) < 8:
+                    break
+                self.signature = bytearray_to_bytes(self.buf[:8])
+                del self.buf[:8]
+                if self.signature != png_signature:
+                    raise FormatError("PNG file has invalid signature.")
+                self.state = 'header'
+            elif self.state == 'header':
+                if len(self.buf) < 8:
+                    break
+                self.file = _readable(bytearray_to_bytes(self.buf[:8]))
+                del self.buf[:8]
+                self.atchunk = self.chunklentype()
+                if self.atchunk[1] == 'IDAT':
+                    self.start_idat()
+                    self.remaining = self.atchunk[0]
+                    self.verify = zlib.crc32(strtobytes('IDAT'))
+                    self.state = 'idat'
+                else:
+                    self.state = 'data'
+            elif self.state == 'data':
+                length, chunk_type = self.atchunk
+                if len(self.buf) < length + 4:
+                    break
+                self.file = _readable(bytearray_to_bytes(
+                    self.buf[:length + 4]))
+                del self.buf[:length + 4]
+                chunk_type, data = self.chunk(lenient=self.lenient)
+                method = getattr(self, '_process_' + chunk_type, None)
+                if method:
+                    method(data)
+                if chunk_type == 'IEND':
+                    self.state = 'end'
+                else:
+                    self.state = 'header'
+            elif self.state == 'idat':
+                if self.remaining and not self.buf:
+                    break
+                data = bytearray_to_bytes(self.buf[:self.remaining])
+                del self.buf[:self.remaining]
+                self.remaining -= len(data)
+                if self._crc_needed('IDAT'):
+                    self.verify = zlib.crc32(data, self.verify)
+                rows.extend(self.decode_idat(data))
+                if not self.remaining:
+                    self.state = 'checksum'
+            elif self.state == 'checksum':
+                if len(self.buf) < 4:
+                    break
+                if self._crc_needed('IDAT'):
+                    self._check_crc('IDAT', bytearray_to_bytes(self.buf[:4]),
+                                    self.verify, self.lenient)
+                del self.buf[:4]
+                self.atchunk = None
+                self.state = 'header'
+            else:
+                # Anything after IEND is ignored
+                del self.buf[:]
+                break
+        return rows
+
+    def start_idat(self):
+        """Prepare decoding when first ``IDAT`` chunk starts"""
+        if self.filt is not None:
+            return
+        if not hasattr(self, 'row_bytes'):
+            raise FormatError('IHDR chunk is missing.')
+        if self.colormap and not self.plte:
+            warnings.warn("PLTE chunk is required before IDAT chunk")
+        self.filt = Filter(self.bitdepth * self.planes)
+        if self.interlace:
+            if self.bitdepth > 8:
+                self.image = newHarray(self.width * self.planes * self.height)
+            else:
+                self.image = newBarray(self.width * self.planes * self.height)
+            self.passrows = self._passrows(self.raw)
+        if self.decompress_limit is None:
+            self.decompress_limit = max(2 ** 16, 4 * (self.row_bytes + 1))
+
+    def decode_idat(self, data):
+        """Decompress `data` of ``IDAT`` and return complete rows"""
+        rows = []
+        while data:
+            piece = self.decompressor.decompress(data, self.decompress_limit)
+            data = self.decompressor.unconsumed_tail
+            rows.extend(self.decode_piece(piece))
+        return rows
+
+    def decode_piece(self, piece):
+        """Return rows completed by decompressed `piece`"""
+        self.raw.extend(piece)
+        if self.interlace:
+            for item in self.passrows:
+                if item is None:
+                    # Need more data
+                    break
+                self._putpass(self.image, *item)
+            return []
+        return list(self.iterboxed(self._splitrows(self.raw, self.filt)))
+
+    def close(self):
+        """
+        Finish decoding.
+
+        Returns remaining rows (all rows of interlaced image) and checks
+        that PNG data was complete.
+        """
+        if self.state != 'end':
+            raise FormatError('PNG data is incomplete.')
+        if self.filt is None:
+            raise FormatError('This PNG file has no IDAT chunks.')
+        rows = self.decode_piece(self.decompressor.flush())
+        if self.interlace:
+            for item in self.passrows:
+                # Generator stops after last row of last pass
+                raise FormatError('Not enough data for interlaced image.')
+            rows = list(self._flatrows(self.image))
+            self.image = None
+        # Data left after last row (of last pass for interlaced image)
+        if len(self.raw) != 0:
+            raise FormatError('Wrong size for decompressed IDAT chunk.')
+        return rows
+
+
+ProbeInfo = namedtuple('ProbeInfo',
+                       'width height bitdepth color_type interlace chunks')
+
+
+def probe(source, chunks=('IHDR', 'pHYs', 'gAMA'), prefix=4096):
+    """
+    Read basic information about PNG image without decoding it.
+
+    `source` is a file name (string or path-like object), a file-like
+    object (read from its current position) or a buffer with PNG data.
+    Byte string is taken as PNG data when it starts with PNG signature
+    and as file name otherwise, so it works the same way on Python 2
+    and 3.  Only beginning of file is
+    read: usually a single read of `prefix` bytes, more only when
+    requested chunks are beyond it.
+
+    Returns :class:`ProbeInfo` named tuple: *width*, *height*,
+    *bitdepth*, *color_type* and *interlace* from ``IHDR`` and *chunks*,
+    dictionary with data of other chunks from `chunks` which were found
+    before image data.  Checksums are not verified.
+    """
+    if hasattr(source, '__fspath__'):
+        source = source.__fspath__()
+        is_path = True
+    elif isinstance(source, bytes):
+        is_path = source[:8] != png_signature
+    else:
+        is_path = isinstance(source, unicode)
+    if is_path:
+        fd = os.open(source, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            return _probe(_fd_reader(fd), chunks, prefix)
+        finally:
+            os.close(fd)
+    elif hasattr(source, 'read'):
+        start = source.tell()
+
+        def read_at(offset, length):
+            source.seek(start + offset)
+            return source.read(length)
+        return _probe(read_at, chunks, prefix)
+    else:
+        if memoryview is None:
+            # Python 2.6: buffer is sliced as is
+            data = source
         else:
-            assert not meta['alpha'] and not meta['greyscale']
-            # RGB to RGBA
+            data = memoryview(source)
+            if _memoryview_cast:
+                data = data.cast('B')
+        return _probe(lambda offset, length: data[offset:offset + length],
+                      chunks, prefix)
+
+
+def _fd_reader(fd):
+    """Function to read `length` bytes at `offset` of file descriptor"""
+    if hasattr(os, 'pread'):
+        return lambda offset, length: os.pread(fd, length, offset)
+
+    def read_at(offset, length):
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, length)
+    return read_at
+
+
+def _probe(read_at, chunks, prefix):
+    """Implementation of :meth:`probe` with `read_at` function"""
+    data = bytearray(read_at(0, prefix))
+    if data[:8] != png_signature:
+        raise FormatError("PNG file has invalid signature.")
+    if len(data) < 33 or data[12:16] != strtobytes('IHDR'):
+        raise FormatError('IHDR chunk is missing.')
+    width, height, bitdepth, color_type, _, _, interlace = \
+        struct.unpack("!2I5B", bytearray_to_bytes(data[16:29]))
+    check_bitdepth_colortype(bitdepth, color_type)
+    found = dict()
+    wanted = set(chunks) - set(['IHDR'])
+    # File offset of data[0] and of current chunk
+    data_start = 0
+    offset = 33
+    while wanted:
+        pos = offset - data_start
+        if len(data) < pos + 8:
+            data = bytearray(read_at(offset, prefix))
+            data_start, pos = offset, 0
+            if len(data) < 8:
+                break
+        length, chunk_type = struct.unpack(
+            '!I4s', bytearray_to_bytes(data[pos:pos + 8]))
+        chunk_type = bytestostr(chunk_type)
+        if chunk_type in ('IDAT', 'IEND'):
+            break
+        if chunk_type in wanted:
+            end = pos + 8 + length
+            if len(data) < end:
+                data.extend(read_at(data_start + len(data), end - len(data)))
+                if len(data) < end:
+                    raise FormatError('Chunk %s too short for required %i '
+                                      'octets.' % (chunk_type, length))
+            found[chunk_type] = bytearray_to_bytes(data[pos + 8:end])
+            wanted.discard(chunk_type)
+        # Length, type, data and checksum
+        offset += 12 + length
+    return ProbeInfo(width, height, bitdepth, color_type, interlace, found)
+
+
+def probe_many(sources, chunks=('IHDR', 'pHYs', 'gAMA'), threads=None):
+    """
+    Iterator over results of :meth:`probe` for every item of `sources`.
 
-            def convert():
-                for row in pixels:
-                    a = newarray()
-                    filt.convert_rgb_to_rgba(row, a)
-                    yield a
-        meta['alpha'] = True
-        meta['greyscale'] = False
-        return width, height, convert(), meta
+    Files are probed in a pool of `threads` threads (number of CPUs by
+    default), results are yielded in order of `sources`.  When file
+    could not be probed the exception (``Error`` or ``EnvironmentError``)
+    is yielded in place of result, so one broken file does not stop the
+    scan.
+    """
+    def probe_one(source):
+        """Probe or return exception"""
+        try:
+            return probe(source, chunks)
+        except (Error, EnvironmentError):
+            return sys.exc_info()[1]
+    if ThreadPool is None or threads == 1:
+        for source in sources:
+            yield probe_one(source)
+        return
+    pool = ThreadPool(threads)
+    try:
+        for result in pool.imap(probe_one, sources, 16):
+            yield result
+    finally:
+        pool.terminate()
 
 
 def check_bitdepth_colortype(bitdepth, colortype):
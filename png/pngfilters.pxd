@@ -47,14 +47,18 @@ cdef class BaseFilter:
 
 	cpdef undo_filter(self, int filter_type, unsigned char[::1] line)
 
+	cpdef _undo_filter(self, int filter_type, unsigned char[::1] line)
+
 	cpdef _filter_scanline(self, int filter_type, unsigned char[::1] line, unsigned char[::1] result)
 
+	@cython.locals(ai=cython.int, i=cython.int, x=cython.int, a=cython.int, b=cython.int, c=cython.int, r=cython.int, pa=cython.int, pb=cython.int, pc=cython.int, pr=cython.int, s0=cython.long, s1=cython.long, s2=cython.long, s3=cython.long, s4=cython.long, score=cython.long, best=cython.int, previous=buf_arr)
+	cpdef int _best_filter(self, unsigned char[::1] line)
+
 	@cython.locals(i=cython.int, j=cython.int)
 	cpdef convert_la_to_rgba(self, unsigned char[::1] row, unsigned char[::1] result)
 
 	@cython.locals(i=cython.int, j=cython.int)
 	cpdef convert_l_to_rgba(self, unsigned char[::1] row, unsigned char[::1] result)
-	
-	@cython.locals(i=cython.int, j=cython.int)                         
+
+	@cython.locals(i=cython.int, j=cython.int)
 	cpdef convert_rgb_to_rgba(self, unsigned char[::1] row, unsigned char[::1] result)
-	
\ No newline at end of file
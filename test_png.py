@@ -30,6 +30,7 @@ import zlib
 import itertools
 import datetime
 import os.path
+import tempfile
 
 try:
     from itertool import izip as zip
@@ -311,6 +312,495 @@ class Test(unittest.TestCase):
                 self.assertEqual([list(it) for it in ps],
                                  [list(it) for it in pi])
 
+    def testThreadsWrite(self):
+        """Parallel compression produce same image as serial one"""
+        rows = [[(x * y) % 251 for x in range(300)] for y in range(200)]
+        for compression in (None, 1, 9):
+            pngs = topngbytes('threads.png', rows, 100, 200,
+                              compression=compression, chunk_limit=5000,
+                              threads=4, filter_type='sum')
+            r = png.Reader(bytes=pngs)
+            r.preamble()
+            # zlib checks combined Adler-32 at end of stream
+            zlib.decompress(strtobytes('').join(r.idat()))
+            pixels = png.Reader(bytes=pngs).read()[2]
+            self.assertEqual([list(it) for it in pixels], rows)
+
+    def testThreadsAdler(self):
+        """Combined Adler-32 of parallel blocks is checksum of all data"""
+        if png.png.ThreadPool is None:
+            return
+        blocks = [strtobytes(''.join([chr((i * n) % 256)
+                                      for i in range(40000)]))
+                  for n in range(1, 9)]
+        data = strtobytes('').join(blocks)
+        for compression in (None, 1, 9):
+            w = png.Writer(1, 1, compression=compression, threads=4)
+            stream = strtobytes('').join(w.comp_idat_parallel(blocks))
+            expected = zlib.compress(data, (compression, -1)[
+                compression is None])
+            # Same zlib header and Adler-32 as serial compression
+            self.assertEqual(stream[:2], expected[:2])
+            self.assertEqual(stream[-4:], expected[-4:])
+            self.assertEqual(zlib.decompress(stream), data)
+
+    def testRowsIndex(self):
+        """Random access to rows using checkpoint index"""
+        rows = [[(x * y + y) % 256 for x in range(21)] for y in range(300)]
+        pngs = topngbytes('rows.png', rows, 7, 300, chunk_limit=700,
+                          filter_type='paeth')
+        r = png.Reader(bytes=pngs)
+        index = r.build_index(step=16)
+        self.assertEqual([list(it) for it in r.rows(100, 130)], rows[100:130])
+        self.assertEqual([list(it) for it in r.rows(0, 5)], rows[0:5])
+        self.assertEqual([list(it) for it in r.rows(290)], rows[290:])
+        # Index may be reused by other reader of the same file
+        r = png.Reader(bytes=pngs)
+        self.assertEqual([list(it) for it in r.rows(33, 47, index)],
+                         rows[33:47])
+        # Image data ends before requested row
+        chunks = []
+        for cname, data in png.Reader(bytes=topngbytes(
+                'rows40.png', rows[:40], 7, 40)).chunks():
+            if cname == 'IHDR':
+                data = struct.pack('>I', 7) + struct.pack('>I', 300) + \
+                    data[8:]
+            chunks.append((cname, data))
+        o = BytesIO()
+        png.write_chunks(o, chunks)
+        r = png.Reader(bytes=o.getvalue())
+        r.build_index(step=16)
+        self.assertRaises(png.FormatError, r.rows, 45)
+
+    def testDecompressLimit(self):
+        """Decompressed data is yielded in bounded pieces"""
+        pngs = topngbytes('solid.png', [[7] * 2000] * 500, 2000, 500,
+                          greyscale=True)
+        r = png.Reader(bytes=pngs, decompress_limit=5000)
+        r.preamble()
+        pieces = list(r.idatdecomp())
+        self.assertTrue(max([len(it) for it in pieces]) <= 5000)
+        self.assertEqual(sum([len(it) for it in pieces]), 2001 * 500)
+        pixels = png.Reader(bytes=pngs, decompress_limit=5000).read()[2]
+        self.assertEqual([list(it) for it in pixels], [[7] * 2000] * 500)
+
+    def testUnpackSamples(self):
+        """Test unpacking of samples with different bitdepth"""
+        unpack = png.png.unpack_samples
+        self.assertEqual(list(unpack(bytearray([0x12, 0x34, 0xff, 0xfe]), 16)),
+                         [0x1234, 0xfffe])
+        self.assertEqual(list(unpack(bytearray([0xb4]), 1, 5)),
+                         [1, 0, 1, 1, 0])
+        # Two rows of 3 samples, each padded to byte
+        self.assertEqual(list(unpack(bytearray([0x6c, 0xe4]), 2, 3)),
+                         [1, 2, 3, 3, 2, 1])
+        self.assertEqual(list(unpack(bytearray([0x9f, 0x3c]), 4)),
+                         [9, 15, 3, 12])
+
+    def testPackSamples(self):
+        """Packing samples is reverse of unpacking"""
+        for bitdepth in (1, 2, 4, 16):
+            row = [(it * 37) % (2 ** bitdepth) for it in range(19)]
+            packed = png.png.pack_samples(row, bitdepth)
+            self.assertEqual(len(packed), (19 * bitdepth + 7) // 8)
+            self.assertEqual(
+                list(png.png.unpack_samples(packed, bitdepth, 19)), row)
+
+    def testReadRegion(self):
+        """Region of image is same as cropped full image"""
+        for name in ('basn0g01', 'basn0g02', 'basn0g04', 'basn0g16',
+                     'basn2c16', 'basn3p02', 'basi0g04', 'tbrn2c08'):
+            pngsuite.png[name].seek(0)
+            pngbytes = pngsuite.png[name].read()
+            x, y, pixels, meta = png.Reader(bytes=pngbytes).asDirect()
+            planes = meta['planes']
+            crop = [list(row[5 * planes:24 * planes])
+                    for row in list(pixels)[3:10]]
+            x, y, pixels, meta = png.Reader(bytes=pngbytes).asDirect(
+                region=(5, 3, 19, 7))
+            self.assertEqual((x, y), (19, 7))
+            self.assertEqual(meta['size'], (19, 7))
+            self.assertEqual([list(row) for row in pixels], crop)
+
+    def testPreview(self):
+        """Preview of interlaced image is made of its decoded pixels"""
+        for name in ('basi0g01', 'basi0g16', 'basi2c08', 's09i3p02'):
+            pngsuite.png[name].seek(0)
+            pngbytes = pngsuite.png[name].read()
+            x, y, pixels, meta = png.Reader(bytes=pngbytes).read()
+            full = [list(row) for row in pixels]
+            planes = meta['planes']
+            for passes, (step_x, step_y) in ((1, (8, 8)), (2, (4, 8)),
+                                             (5, (2, 2)), (7, (1, 1))):
+                x, y, pixels, meta = png.Reader(bytes=pngbytes).preview(
+                    passes, replicate=False)
+                grid = [sum([row[i * planes:(i + 1) * planes]
+                             for i in range(0, len(row) // planes, step_x)],
+                            []) for row in full[::step_y]]
+                self.assertEqual([list(row) for row in pixels], grid)
+                self.assertEqual((x, y), (len(grid[0]) // planes, len(grid)))
+            x, y, pixels, meta = png.Reader(bytes=pngbytes).preview(2)
+            pixels = [list(row) for row in pixels]
+            self.assertEqual((x, y), (len(full[0]) // planes, len(full)))
+            self.assertEqual(pixels[7][5 * planes:6 * planes],
+                             full[0][4 * planes:5 * planes])
+        pngsuite.png['basn0g08'].seek(0)
+        self.assertRaises(png.Error,
+                          png.Reader(pngsuite.png['basn0g08']).preview)
+
+    def testDeinterlacePieces(self):
+        """Interlaced data is decoded from pieces of any size"""
+        for name in ('basi0g01', 'basi0g16', 'basi2c08', 's09i3p02'):
+            pngsuite.png[name].seek(0)
+            r = png.Reader(pngsuite.png[name])
+            r.preamble()
+            raw = bytearray(itertools.chain(*r.idatdecomp()))
+            pieces = [raw[i:i + 7] for i in range(0, len(raw), 7)]
+            self.assertEqual(list(r.deinterlace(iter(pieces))),
+                             list(r.deinterlace(raw)))
+            self.assertEqual(list(r.deinterlace(array('B', raw))),
+                             list(r.deinterlace(raw)))
+            self.assertEqual(list(r.deinterlace(bytes(raw))),
+                             list(r.deinterlace(raw)))
+            pngsuite.png[name].seek(0)
+            pngsuite.png[name.replace('i', 'n', 1)].seek(0)
+            self.assertEqual(
+                [list(row) for row in
+                 png.Reader(pngsuite.png[name]).read()[2]],
+                [list(row) for row in png.Reader(
+                    pngsuite.png[name.replace('i', 'n', 1)]).read()[2]])
+        self.assertRaises(png.FormatError, r.deinterlace, raw[:-1])
+
+    def testPipeline(self):
+        """Pipelined reader gives same result and errors"""
+        pngsuite.png['basi2c16'].seek(0)
+        pngbytes = pngsuite.png['basi2c16'].read()
+        pixels = png.Reader(bytes=pngbytes).read()[2]
+        piped = png.Reader(bytes=pngbytes, pipeline=True).read()[2]
+        self.assertEqual([list(row) for row in piped],
+                         [list(row) for row in pixels])
+        r = png.Reader(bytes=pngbytes, pipeline=True, decompress_limit=16)
+        r.preamble()
+        raw = r.idatdecomp()
+        next(raw)
+        raw.close()
+        r = png.Reader(bytes=pngbytes[:-200], pipeline=True)
+        self.assertRaises(png.ChunkError, lambda: list(r.read()[2]))
+
+        def interrupted():
+            """Source stopped not by ordinary exception"""
+            yield 1
+            raise SystemExit()
+        if png.png.threading is not None:
+            self.assertRaises(SystemExit, list,
+                              png.png._prefetch(interrupted()))
+
+    def testReadinto(self):
+        """Decode into buffer with stride"""
+        for name in ('basn0g02', 'basn2c16', 'basi3p08', 'basi0g04',
+                     'basi2c16', 's03i3p01'):
+            pngsuite.png[name].seek(0)
+            pngbytes = pngsuite.png[name].read()
+            x, y, pixels, meta = png.Reader(bytes=pngbytes).read()
+            pixels = [list(row) for row in pixels]
+            arraycode = 'BH'[meta['bitdepth'] > 8]
+            itemsize = array(arraycode).itemsize
+            row_len = x * meta['planes']
+            stride = row_len + 3
+            buf = array(arraycode, [0]) * (stride * y)
+            meta2 = png.Reader(bytes=pngbytes).readinto(
+                buf, stride=stride * itemsize)
+            self.assertEqual(meta2, meta)
+            self.assertEqual([list(buf[i:i + row_len])
+                              for i in range(0, len(buf), stride)], pixels)
+            self.assertEqual(set(buf[row_len:stride]), set([0]))
+            self.assertRaises(ValueError, png.Reader(bytes=pngbytes).readinto,
+                              bytearray(row_len * itemsize * y - 1))
+
+    def testPaletteExpand(self):
+        """Palette images are expanded to colours of their indices"""
+        for name in ('basn3p01', 'basn3p02', 's09n3p02', 'basi3p04',
+                     'basn3p08', 'tbbn3p08'):
+            pngsuite.png[name].seek(0)
+            pngbytes = pngsuite.png[name].read()
+            r = png.Reader(bytes=pngbytes)
+            indices = r.read()[2]
+            plte = r.palette()
+            expected = [sum([list(plte[i]) for i in row], [])
+                        for row in indices]
+            r = png.Reader(bytes=pngbytes)
+            r.preamble()
+            # Only palette expansion
+            r.sbit = None
+            x, y, pixels, meta = r.asDirect()
+            self.assertEqual(meta['planes'], len(plte[0]))
+            self.assertEqual([list(row) for row in pixels], expected)
+        plte = [(1, 2, 3), (4, 5, 6)]
+        expand = png.png.palette_expander(plte, 8, 2)
+        self.assertEqual(list(expand(bytearray([1, 0]))), [4, 5, 6, 1, 2, 3])
+        self.assertRaises(png.FormatError, expand, bytearray([2, 0]))
+        # Padding bits are not checked
+        expand = png.png.palette_expander(plte, 2, 3)
+        self.assertEqual(list(expand(bytearray([0x13]))),
+                         [1, 2, 3, 4, 5, 6, 1, 2, 3])
+        self.assertRaises(png.FormatError, expand, bytearray([0x0c]))
+
+    def testTrnsSbit(self):
+        """Alpha from tRNS and sBIT shift match per-pixel conversion"""
+        for name in ('tbbn0g04', 'tbbn2c16', 'tbrn2c08', 'tbwn0g16',
+                     'cs3n2c16', 'cs5n2c08', 'basi0g02'):
+            pngsuite.png[name].seek(0)
+            pngbytes = pngsuite.png[name].read()
+            r = png.Reader(bytes=pngbytes)
+            x, y, pixels, meta = r.read()
+            planes, maxval = meta['planes'], 2 ** meta['bitdepth'] - 1
+            expected = [list(row) for row in pixels]
+            if r.trns:
+                expected = [sum([list(px) + [maxval * (px != r.transparent)]
+                                 for px in group(row, planes)], [])
+                            for row in expected]
+            if r.sbit:
+                shift = meta['bitdepth'] - max(bytearray(r.sbit))
+                expected = [[it >> shift for it in row] for row in expected]
+            pixels = png.Reader(bytes=pngbytes).asDirect()[2]
+            self.assertEqual([list(row) for row in pixels], expected)
+        # Transparent colour which is not in image
+        self.assertEqual(list(png.png.trns_alpha(bytearray([7, 8]), 1, 8,
+                                                 (300,))),
+                         [7, 255, 8, 255])
+
+    def testConvert(self):
+        """Fused conversions match per-pixel conversion of asDirect"""
+        for name in ('basn0g02', 'basn0g16', 'basn4a08', 'basn2c16',
+                     'basn6a16', 'basn3p04', 'tbrn2c08', 'cs3n2c16'):
+            pngsuite.png[name].seek(0)
+            pngbytes = pngsuite.png[name].read()
+            x, y, pixels, meta = png.Reader(bytes=pngbytes).asDirect()
+            direct = [group(row, meta['planes']) for row in pixels]
+            maxval = 2 ** meta['bitdepth'] - 1
+            for method, channels in (('asRGB8', 3), ('asRGBA8', 4)):
+                if meta['alpha'] and channels == 3:
+                    self.assertRaises(png.Error,
+                        getattr(png.Reader(bytes=pngbytes), method))
+                    continue
+                expected = []
+                for row in direct:
+                    out = []
+                    for px in row:
+                        px = [int(round(it * 255.0 / maxval)) for it in px]
+                        if meta['greyscale']:
+                            px = px[:1] * 3 + px[1:]
+                        if channels == 4 and not meta['alpha']:
+                            px.append(255)
+                        out.extend(px)
+                    expected.append(out)
+                x, y, pixels, info = getattr(png.Reader(bytes=pngbytes),
+                                             method)()
+                self.assertEqual(info['planes'], channels)
+                self.assertEqual(info['bitdepth'], 8)
+                self.assertEqual([list(row) for row in pixels], expected)
+            x, y, pixels, info = png.Reader(bytes=pngbytes).asFloat(2.0)
+            self.assertEqual(info['maxval'], 2.0)
+            self.assertEqual([[round(it, 6) for it in row]
+                              for row in pixels],
+                             [[round(it * 2.0 / maxval, 6) for it in
+                               itertools.chain(*row)] for row in direct])
+
+    def testRescale(self):
+        """Rescaling tables give rounded proportional values"""
+        for source, target in ((1, 8), (3, 8), (8, 16), (16, 8), (5, 4),
+                               (12, 16)):
+            maxval, targetmaxval = 2 ** source - 1, 2 ** target - 1
+            values = range(0, maxval + 1, max(1, maxval // 1000))
+            expected = [int(round(it * float(targetmaxval) / maxval))
+                        for it in values]
+            self.assertEqual(list(png.png.rescale_samples(
+                array('BH'[source > 8], values), source, target)), expected)
+            if source <= 8:
+                self.assertEqual(list(png.png.rescale_samples(
+                    bytearray(values), source, target)), expected)
+        # sBIT-like shift
+        self.assertEqual(list(png.png.rescale_samples(
+            bytearray([0, 8, 255]), 8, 8, 3)), [0, 8, 255])
+        r = png.Reader(bytes=topngbytes('l5.png', [[0, 7, 31]], 3, 1,
+                                        greyscale=True, bitdepth=5))
+        x, y, pixels, meta = r.read()
+        self.assertEqual(meta['bitdepth'], 8)
+        self.assertEqual([list(row) for row in pixels], [[0, 58, 255]])
+        # Samples out of range are not wrapped
+        for row in ([3, -1], [3, 40], bytearray([3, 40])):
+            w = png.Writer(2, 1, greyscale=True, bitdepth=5)
+            self.assertRaises(ValueError, w.write, BytesIO(), [row])
+        # Floats are rounded and rescaled like integers
+        r = png.Reader(bytes=topngbytes('l5float.png', [[0.0, 7.0, 31.0]],
+                                        3, 1, greyscale=True, bitdepth=5))
+        self.assertEqual([list(row) for row in r.read()[2]], [[0, 58, 255]])
+
+    def testProbe(self):
+        """Probe gives header and requested chunks"""
+        pngsuite.png['basi3p02'].seek(0)
+        pngbytes = pngsuite.png['basi3p02'].read()
+        r = png.Reader(bytes=pngbytes)
+        r.preamble()
+        for source in (pngbytes, BytesIO(pngbytes)):
+            info = png.probe(source, chunks=('gAMA', 'PLTE', 'tIME'),
+                             prefix=40)
+            self.assertEqual(info[:5], (r.width, r.height, r.bitdepth,
+                                        r.color_type, r.interlace))
+            self.assertEqual(info.chunks,
+                             {'gAMA': struct.pack('!L', int(r.gamma * 1e5)),
+                              'PLTE': r.plte})
+        source = os.path.join(os.path.dirname(__file__),
+                              'testfiles', 'glenda.png')
+        self.assertEqual(png.probe(source)[:2], (49, 49))
+        # Byte string with file name
+        encoded = source
+        if not isinstance(encoded, bytes):
+            encoded = encoded.encode(sys.getfilesystemencoding())
+        self.assertEqual(png.probe(encoded)[:2], (49, 49))
+        results = list(png.probe_many([BytesIO(pngbytes),
+                                       BytesIO(pngbytes[10:])]))
+        self.assertEqual(results[0].width, 32)
+        self.assertTrue(isinstance(results[1], png.FormatError))
+
+    def testAsyncReader(self):
+        """Decode from asyncio stream"""
+        try:
+            import asyncio
+        except ImportError:
+            return
+        if not hasattr(png, 'AsyncReader'):
+            return
+        loop = asyncio.new_event_loop()
+        try:
+            for name in ('basn0g01', 'basi2c16', 'tbrn2c08'):
+                pngsuite.png[name].seek(0)
+                pngbytes = pngsuite.png[name].read()
+                x, y, pixels, meta = png.Reader(bytes=pngbytes).read()
+                stream = asyncio.StreamReader(loop=loop)
+                for i in range(0, len(pngbytes), 50):
+                    stream.feed_data(pngbytes[i:i + 50])
+                stream.feed_eof()
+                r = png.AsyncReader(stream)
+                x2, y2, rows, meta2 = loop.run_until_complete(r.read())
+                self.assertEqual((x2, y2, meta2), (x, y, meta))
+                for row in pixels:
+                    self.assertEqual(list(loop.run_until_complete(
+                        rows.__anext__())), list(row))
+                self.assertRaises(StopAsyncIteration, loop.run_until_complete,
+                                  rows.__anext__())
+                # Synchronous reading methods are not available
+                self.assertRaises(png.Error, r.asRGBA8)
+                self.assertTrue(callable(r.rows))
+        finally:
+            loop.close()
+
+    def testCrcPolicy(self):
+        """Checksums are verified according to policy"""
+        pngsuite.png['basn3p04'].seek(0)
+        pngbytes = bytearray(pngsuite.png['basn3p04'].read())
+        # Break checksum of gAMA chunk (first one after IHDR)
+        self.assertEqual(pngbytes[37:41], strtobytes('gAMA'))
+        gama = bytearray(pngbytes)
+        gama[33 + 8 + 4] ^= 1
+        gama = bytes(gama)
+        self.assertRaises(png.ChunkError,
+                          png.Reader(bytes=gama).read)
+        png.Reader(bytes=gama, crc='critical-only').read()
+        png.Reader(bytes=gama, crc='skip').read()
+        import warnings
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', RuntimeWarning)
+            png.Reader(bytes=gama, crc='lenient').read()
+        self.assertEqual(len(caught), 1)
+        # Break checksum of IDAT
+        idat = bytearray(pngbytes)
+        idat[idat.find(strtobytes('IEND')) - 5] ^= 1
+        idat = bytes(idat)
+        for crc in ('verify', 'critical-only'):
+            r = png.Reader(bytes=idat, crc=crc)
+            self.assertRaises(png.ChunkError, lambda: list(r.read()[2]))
+        list(png.Reader(bytes=idat, crc='skip').read()[2])
+        self.assertRaises(ValueError, png.Reader, bytes=idat, crc='maybe')
+
+        class Unseekable(object):
+            """Stream which could be only read"""
+            def __init__(self, data):
+                self.file = BytesIO(data)
+
+            def read(self, n):
+                return self.file.read(n)
+
+        # Chunks skipped with `seek` are not checked
+        for f in (BytesIO(gama), Unseekable(gama)):
+            self.assertEqual(png.Reader(file=f).chunk(seek='IEND'),
+                             ('IEND', strtobytes('')))
+        # but truncated ones are reported
+        for f in (BytesIO(gama[:60]), Unseekable(gama[:60])):
+            self.assertRaises(png.ChunkError,
+                              png.Reader(file=f).chunk, seek='IEND')
+
+    def testDecoder(self):
+        """Push decoder gives rows as data is fed"""
+        for name in ('basn0g01', 'basn2c16', 'basi3p08', 'tbrn2c08'):
+            pngsuite.png[name].seek(0)
+            pngbytes = pngsuite.png[name].read()
+            r = png.Reader(bytes=pngbytes)
+            x, y, pixels, meta = r.read()
+            pixels = [list(row) for row in pixels]
+            d = png.Decoder()
+            rows = []
+            for i in range(0, len(pngbytes), 61):
+                rows.extend(d.feed(pngbytes[i:i + 61]))
+                if i == 61 * 5 and not meta['interlace']:
+                    # Rows are available before all data is fed
+                    self.assertTrue(0 < len(rows) < y)
+                # Only incomplete row of interlace pass is kept
+                self.assertTrue(len(d.raw) <= d.row_bytes + 1)
+            rows.extend(d.close())
+            self.assertEqual([list(row) for row in rows], pixels)
+            self.assertEqual(d._metadata(), meta)
+        d = png.Decoder()
+        d.feed(pngbytes[:-20])
+        self.assertRaises(png.FormatError, d.close)
+        # Options and methods of pull-style reading are not available
+        self.assertRaises(TypeError, png.Decoder, reuse_rows=True)
+        self.assertRaises(png.Error, png.Decoder().asRGBA8)
+        broken = bytearray(pngbytes)
+        broken[broken.find(strtobytes('IEND')) - 5] ^= 1
+        self.assertRaises(png.ChunkError, png.Decoder().feed, bytes(broken))
+        # Extra data after last pass of interlaced image
+        pngsuite.png['basi0g08'].seek(0)
+        r = png.Reader(pngsuite.png['basi0g08'])
+        chunks = []
+        for cname, data in r.chunks():
+            if cname == 'IDAT':
+                data = zlib.compress(zlib.decompress(data) +
+                                     strtobytes('\x00garbage'))
+            chunks.append((cname, data))
+        o = BytesIO()
+        png.write_chunks(o, chunks)
+        d = png.Decoder()
+        d.feed(o.getvalue())
+        self.assertRaises(png.FormatError, d.close)
+
+    def testReuseRows(self):
+        """Rows decoded in two swapped buffers"""
+        for name in ('basn0g04', 'basn2c16', 'f04n2c08'):
+            pngsuite.png[name].seek(0)
+            pngbytes = pngsuite.png[name].read()
+            rows = [list(row) for row in png.Reader(bytes=pngbytes).read()[2]]
+            r = png.Reader(bytes=pngbytes, reuse_rows=True,
+                           decompress_limit=100)
+            reused = set()
+            # Rows are compared as they come, each one overwrites previous
+            for i, row in enumerate(r.read()[2]):
+                self.assertEqual(list(row), rows[i])
+                reused.add(id(getattr(row, 'obj', row)))
+            self.assertEqual(i + 1, len(rows))
+            if r.bitdepth == 8:
+                self.assertEqual(len(reused), 2)
+
     def testLA4(self):
         """Create an LA image with bitdepth 4."""
         imbytes = topngbytes('la4.png', [[5, 12]], 1, 1,
@@ -666,6 +1156,35 @@ class Test(unittest.TestCase):
         r = png.Reader(pngsuite.png["tbrn2c08"])
         buffer(list(r.asDirect()[2])[0])
 
+    def testMmap(self):
+        """Test reading memory mapped file"""
+        s = os.path.join(os.path.dirname(__file__), 'testfiles', 'glenda.png')
+        r = png.Reader(filename=s, mmap=True)
+        rpix, metar = r.asDirect()[2:]
+        spix, metas = png.Reader(filename=s).asDirect()[2:]
+        self.assertEqual(metar, metas)
+        self.assertEqual([list(it) for it in rpix],
+                         [list(it) for it in spix])
+        # PNG embedded after other data
+        tmp = tempfile.TemporaryFile()
+        try:
+            tmp.write(strtobytes('garbage'))
+            with open(s, 'rb') as source:
+                tmp.write(source.read())
+            tmp.seek(7)
+            r = png.Reader(file=tmp, mmap=True)
+            rpix = r.asDirect()[2]
+            self.assertEqual([list(it) for it in rpix],
+                             [list(it) for it in
+                              png.Reader(filename=s).asDirect()[2]])
+            # Mapping is closed with reader, but file is left open
+            r.close()
+            if hasattr(r.file, 'map'):
+                self.assertTrue(r.file.map.closed)
+            self.assertFalse(tmp.closed)
+        finally:
+            tmp.close()
+
     # Invalid file format tests.  These construct various badly
     # formatted PNG files, then feed them into a Reader.  When
     # everything is working properly, we should get FormatError
@@ -960,6 +1479,53 @@ class Test(unittest.TestCase):
         out = filter_.undo_filter(scanline[0], scanline[1:])
         self.assertEqual(list(out), [8, 10, 9, 108, 111, 113])  # paeth
 
+    def testDoFilterReuse(self):
+        """Filtering rows in reused buffers"""
+        prev = array('B', [20, 21, 22, 210, 211, 212])
+        line = array('B', [30, 32, 34, 230, 233, 236])
+        for reuse in (False, True):
+            for filter_type in range(5):
+                expected = png.Filter(24, prev=prev).filter_all(line)
+                filter_ = png.Filter(24, prev=prev, reuse=reuse)
+                res = filter_.do_filter(filter_type, line)
+                self.assertEqual(list(res), list(expected[filter_type]))
+                # Unfiltered row is previous one for the next row
+                res = filter_.do_filter(filter_type, prev)
+                expected = png.Filter(24, prev=line).filter_all(prev)
+                self.assertEqual(list(res), list(expected[filter_type]))
+        # Interlace passes with different row lengths
+        pngsuite.png['basi2c08'].seek(0)
+        pngbytes = pngsuite.png['basi2c08'].read()
+        x, y, pixels, meta = png.Reader(bytes=pngbytes).read()
+        pixels = [list(row) for row in pixels]
+        for filter_type in (0, 3, 4, {'name': 'sum'}):
+            out = BytesIO()
+            png.Writer(x, y, interlace=True,
+                       filter_type=filter_type).write(out, pixels)
+            res = png.Reader(bytes=out.getvalue()).read()[2]
+            self.assertEqual([list(row) for row in res], pixels)
+
+    def testFilterMsad(self):
+        """Adaptive filter with minimal sum of absolute differences"""
+        prev = array('B', [20, 21, 22, 210, 211, 212])
+        line = array('B', [30, 32, 34, 230, 233, 236])
+        for start in (None, prev):
+            lines = png.Filter(24, prev=start).filter_all(line)
+            # Bytes are signed: 255 is -1
+            sums = [sum(min(it, 256 - it) for it in row[1:])
+                    for row in lines]
+            res = png.Filter(24, prev=start).do_filter('msad', line)
+            self.assertEqual(list(res), list(lines[sums.index(min(sums))]))
+        pngsuite.png['basn2c16'].seek(0)
+        x, y, pixels, meta = png.Reader(
+            bytes=pngsuite.png['basn2c16'].read()).read()
+        pixels = [list(row) for row in pixels]
+        out = BytesIO()
+        png.Writer(x, y, bitdepth=16,
+                   filter_type='msad').write(out, pixels)
+        res = png.Reader(bytes=out.getvalue()).read()[2]
+        self.assertEqual([list(row) for row in res], pixels)
+
     def testModifyRows(self):
         """
         Tests that the rows yielded by the pixels generator
@@ -1267,6 +1833,16 @@ try:
             topngbytes('numpyuint16.png', rows, 4, 1,
                        greyscale=True, alpha=False, bitdepth=16)
 
+        def testNumpyRescale(self):
+            """numpy rows and samples at non-native bitdepth."""
+            for rows in ([numpy.array([0, 7, 31], numpy.uint8)],
+                         [[numpy.uint16(it) for it in (0, 7, 31)]],
+                         [numpy.array([0, 7, 31], numpy.float64)]):
+                r = png.Reader(bytes=topngbytes('numpyl5.png', rows, 3, 1,
+                                                greyscale=True, bitdepth=5))
+                self.assertEqual([list(row) for row in r.read()[2]],
+                                 [[0, 58, 255]])
+
         def testNumpyuint8(self):
             """numpy uint8."""
             rows = [[numpy.uint8(it) for it in range(0, 0x100, 0x55)]]
@@ -1286,6 +1862,88 @@ try:
             img = png.from_array(pixels, 'L')
             img.save(BytesIO())
 
+        def testFilters(self):
+            """NumPy filters give same result as pure python"""
+            line = bytearray([(it * 97) % 256 for it in range(48)])
+            prev = bytearray([(it * 51) % 256 for it in range(48)])
+            for bitdepth in (8, 24, 48):
+                for filter_type in range(5):
+                    for prev_ in (None, prev):
+                        res = []
+                        for use_numpy in (False, True):
+                            filt = png.png.npBaseFilter(bitdepth)
+                            # Without NumPy pure python methods are used
+                            filt.use_numpy = use_numpy
+                            filt.prev = prev_ and bytearray(prev_)
+                            out = bytearray(line)
+                            filt._filter_scanline(filter_type, line, out)
+                            filt.prev = prev_ and bytearray(prev_)
+                            back = filt.undo_filter(filter_type,
+                                                    bytearray(out))
+                            res.append((list(out), list(back)))
+                        self.assertEqual(res[0], res[1])
+                        self.assertEqual(res[1][1], list(line))
+
+        def testWriteNdarray(self):
+            """NumPy arrays are written without conversion to lists"""
+            rgb = (numpy.arange(7 * 5 * 3) * 37 % 256).astype(numpy.uint8)
+            rgb = rgb.reshape(7, 5, 3)
+            grey16 = (numpy.arange(7 * 5) * 4099 % 65536).astype(numpy.uint16)
+            grey16 = grey16.reshape(7, 5)
+            grey1 = (numpy.arange(7 * 9).reshape(7, 9) % 3) == 0
+            grey4 = numpy.arange(7 * 5).reshape(7, 5) % 16
+            grey4 = grey4.astype(numpy.uint8)
+            cases = [(rgb, 'RGB'), (rgb[:, ::-1], 'RGB'), (grey16, 'L'),
+                     (grey1, 'L'), (grey4, 'L;4'), (grey4 % 8, 'L;3')]
+            for a, mode in cases:
+                for interlace in (False, True):
+                    f = BytesIO()
+                    png.from_array(a, mode, {'interlace': interlace}).save(f)
+                    x, y, pixels, meta = png.Reader(bytes=f.getvalue()).read()
+                    if mode == 'L;3':
+                        # Rescaled to 4 bits
+                        self.assertEqual(meta['bitdepth'], 4)
+                        continue
+                    self.assertEqual([list(row) for row in pixels],
+                                     a.astype(int).reshape(y, -1).tolist())
+            f = BytesIO()
+            png.Writer(5, 7, greyscale=True, bitdepth=16).write_array(
+                f, grey16.reshape(-1))
+            x, y, pixels, meta = png.Reader(bytes=f.getvalue()).read()
+            self.assertEqual([list(row) for row in pixels], grey16.tolist())
+            # Values are not truncated to bitdepth
+            wide = grey4.astype(numpy.int32)
+            wide[3, 2] = 300
+            for bitdepth, a in ((8, wide), (3, -wide)):
+                w = png.Writer(5, 7, greyscale=True, bitdepth=bitdepth)
+                self.assertRaises(ValueError, w.write, BytesIO(), a)
+            w = png.Writer(5, 7, greyscale=True, bitdepth=8)
+            f = BytesIO()
+            w.write(f, wide % 256)
+            pixels = png.Reader(bytes=f.getvalue()).read()[2]
+            self.assertEqual([list(row) for row in pixels],
+                             (wide % 256).tolist())
+
+        def testAsNdarray(self):
+            """Image decoded into NumPy array"""
+            for name in ('basn0g02', 'basi2c16', 'basn3p04', 'tbrn2c08'):
+                pngsuite.png[name].seek(0)
+                pngbytes = pngsuite.png[name].read()
+                for mode, method in (('native', 'read'),
+                                     ('direct', 'asDirect'),
+                                     ('RGBA8', 'asRGBA8'),
+                                     ('float', 'asFloat')):
+                    x, y, pixels, meta = getattr(png.Reader(bytes=pngbytes),
+                                                 method)()
+                    a = png.Reader(bytes=pngbytes).as_ndarray(mode)
+                    self.assertEqual(a.shape, (y, x, meta['planes']))
+                    self.assertEqual(a.reshape(y, -1).tolist(),
+                                     [list(row) for row in pixels])
+                    if meta.get('bitdepth', 8) > 8:
+                        self.assertEqual(a.dtype, numpy.uint16)
+            self.assertRaises(ValueError,
+                              png.Reader(bytes=pngbytes).as_ndarray, 'CMYK')
+
         def testPalette(self):
             """Palette as NumPy array"""
             s = ['110010010011',